@@ -1,24 +1,297 @@
+import os
+import shutil
+import uuid
+
+import numpy as np
 import pandas as pd
 
 from datetime import datetime
 
+from Instrumentation import add_counters, instrument
+from UserDictionary import UserDictionary, has_user_filter
+
+
+class _TableIndex:
+
+    def __init__(self, table):
+        """Индекс таблицы для быстрого получения срезов по дате и user_id.
+
+        Строки таблицы не переупорядочиваются, индекс хранит только позиции строк:
+            dates - столбец date таблицы (без копирования),
+            order - позиции строк, отсортированные по дате (сортировка устойчивая),
+                None, если таблица уже отсортирована по дате (обычный случай для логов),
+            sorted_dates - значения дат в порядке сортировки, по ним ищем границы интервала бинпоиском,
+                для отсортированной таблицы это сам dates,
+            n_valid_dates - количество строк с непустой датой (NaT при сортировке уходят в конец),
+            user_order, user_offsets - позиции строк, сгруппированные по коду пользователя (CSR):
+                позиции строк пользователя с кодом c - user_order[user_offsets[c]:user_offsets[c + 1]],
+            user_codes - None, если user_offsets плотный (по всем кодам до максимального), иначе
+                отсортированные коды пользователей куска: позиции строк пользователя user_codes[i] -
+                user_order[user_offsets[i]:user_offsets[i + 1]]. Разреженный вариант используется, когда кодов
+                больше, чем строк (например, небольшая пачка новых строк), чтобы память и время построения
+                индекса зависели от размера куска, а не от количества пользователей в словаре.
+
+        :param table (pd.DataFrame): таблица с данными, user_id закодированы UserDictionary.
+        """
+        self.n_rows = len(table)
+        self.dates = None
+        self.order = None
+        self.sorted_dates = None
+        self.n_valid_dates = None
+        self.is_sorted = False
+        self.user_order = None
+        self.user_offsets = None
+        self.user_codes = None
+
+        if 'date' in table.columns and pd.api.types.is_datetime64_any_dtype(table['date']):
+            self._set_dates(table['date'].values)
+
+        if 'user_id' in table.columns:
+            codes = table['user_id'].values
+            self._set_user_order(codes, np.argsort(codes, kind='stable'))
+
+    def _set_dates(self, dates):
+        self.dates = dates
+        is_nat = np.isnat(dates)
+        self.n_valid_dates = self.n_rows - int(is_nat.sum())
+        valid_dates = dates[:self.n_valid_dates]
+        # Отсортированная таблица - все NaT в конце, остальные даты не убывают, тогда argsort не нужен
+        self.is_sorted = not is_nat[:self.n_valid_dates].any() and bool((valid_dates[1:] >= valid_dates[:-1]).all())
+        if self.is_sorted:
+            self.order = None
+            self.sorted_dates = dates
+        else:
+            self.order = np.argsort(dates, kind='stable')
+            self.sorted_dates = dates[self.order]
+
+    def _set_user_order(self, codes, user_order):
+        # Строки без пользователя (отрицательный код) при сортировке по коду идут первыми
+        # и не входят в позиции ни одного пользователя
+        self.user_order = user_order
+        sorted_codes = codes[user_order]
+        n_missing = np.searchsorted(sorted_codes, 0)
+        sorted_codes = sorted_codes[n_missing:]
+        max_code = int(sorted_codes[-1]) if len(sorted_codes) else -1
+        if max_code < self.n_rows:
+            self.user_codes = None
+            self.user_offsets = np.zeros(max_code + 2, dtype=np.int64)
+            np.cumsum(np.bincount(sorted_codes, minlength=max_code + 1), out=self.user_offsets[1:])
+        else:
+            starts = np.flatnonzero(np.diff(sorted_codes, prepend=-1))
+            self.user_codes = sorted_codes[starts]
+            self.user_offsets = np.append(starts, len(sorted_codes)).astype(np.int64)
+        self.user_offsets += n_missing
+
+    @property
+    def has_users(self):
+        return self.user_order is not None
+
+    @classmethod
+    def extend(cls, index, table, n_old_rows):
+        """Возвращает индекс таблицы, к которой в конец добавили строки.
+
+        Если новые строки не раньше уже имеющихся (например, добавили очередной день данных),
+        то индекс дополняется без пересортировки всей таблицы, иначе строится заново.
+
+        :param index (_TableIndex): индекс таблицы до добавления строк.
+        :param table (pd.DataFrame): таблица после добавления строк.
+        :param n_old_rows (int): количество строк в таблице до добавления.
+        """
+        new_rows = table.iloc[n_old_rows:]
+        if index.has_dates:
+            new_dates = new_rows['date'].values
+            is_appendable = (
+                pd.api.types.is_datetime64_any_dtype(new_rows['date'])
+                and index.n_valid_dates == index.n_rows
+                and not np.isnat(new_dates).any()
+                and (index.n_rows == 0 or len(new_dates) == 0 or new_dates.min() >= index.sorted_dates[-1])
+            )
+            if not is_appendable:
+                return cls(table)
+
+        extended = cls.__new__(cls)
+        extended.__dict__.update(index.__dict__)
+        extended.n_rows = len(table)
+        if index.has_dates:
+            new_order = np.argsort(new_dates, kind='stable')
+            is_new_sorted = bool((new_order == np.arange(len(new_order))).all())
+            extended.dates = table['date'].values
+            extended.n_valid_dates = extended.n_rows
+            extended.is_sorted = index.is_sorted and is_new_sorted
+            if extended.is_sorted:
+                extended.order = None
+                extended.sorted_dates = extended.dates
+            else:
+                old_order = np.arange(n_old_rows) if index.order is None else index.order
+                extended.order = np.concatenate([old_order, n_old_rows + new_order])
+                extended.sorted_dates = np.concatenate([index.sorted_dates, new_dates[new_order]])
+        if index.has_users:
+            # Старые позиции уже отсортированы по коду, новые сортируем отдельно и сливаем два отсортированных
+            # куска устойчивой сортировкой (timsort делает это за линейное время)
+            codes = table['user_id'].values
+            user_order = np.concatenate([
+                index.user_order, n_old_rows + np.argsort(codes[n_old_rows:], kind='stable')
+            ])
+            extended._set_user_order(codes, user_order[np.argsort(codes[user_order], kind='stable')])
+        return extended
+
+    @property
+    def has_dates(self):
+        return self.dates is not None
+
+    def _to_datetime64(self, value):
+        return pd.Timestamp(value).to_datetime64()
+
+    def get_date_bounds(self, begin_date, end_date):
+        """Возвращает границы [lo, hi) интервала дат в порядке сортировки.
+
+        Обе границы включаются, как и при фильтрации df['date'] >= begin_date, df['date'] <= end_date.
+        """
+        lo, hi = 0, self.n_rows
+        if begin_date:
+            lo = np.searchsorted(self.sorted_dates, self._to_datetime64(begin_date), side='left')
+            hi = self.n_valid_dates
+        if end_date:
+            hi = min(hi, np.searchsorted(self.sorted_dates[:self.n_valid_dates], self._to_datetime64(end_date), side='right'))
+        return lo, max(lo, hi)
+
+    def get_date_mask(self, positions, begin_date, end_date):
+        """Возвращает маску позиций, даты которых попадают в интервал [begin_date, end_date]."""
+        dates = self.dates[positions]
+        mask = np.ones(len(positions), dtype=bool)
+        if begin_date:
+            mask &= dates >= self._to_datetime64(begin_date)
+        if end_date:
+            mask &= dates <= self._to_datetime64(end_date)
+        return mask
+
+    def get_user_positions(self, user_codes):
+        """Возвращает отсортированные позиции строк пользователей с указанными кодами."""
+        user_codes = np.unique(user_codes)
+        if self.user_codes is None:
+            slots = user_codes[(user_codes >= 0) & (user_codes < len(self.user_offsets) - 1)]
+        else:
+            slots = np.searchsorted(self.user_codes, user_codes)
+            is_found = slots < len(self.user_codes)
+            is_found[is_found] = self.user_codes[slots[is_found]] == user_codes[is_found]
+            slots = slots[is_found]
+        starts = self.user_offsets[slots]
+        counts = self.user_offsets[slots + 1] - starts
+        ends = np.cumsum(counts)
+        positions = np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+        return np.sort(self.user_order[positions])
+
 
 class DataService:
 
-    def __init__(self, table_name_2_table):
+    # Куски таблицы сливаются, пока предпоследний кусок меньше merge_factor * последний кусок
+    merge_factor = 2
+    # Максимальное количество строк в одной части таблицы, которую возвращает iter_data_chunks
+    read_chunk_size = 1_000_000
+
+    def __init__(self, table_name_2_table, user_dictionary=None):
         """Класс, предоставляющий доступ к сырым данным.
-        
+
+        user_id при добавлении таблицы кодируются общим словарём UserDictionary, таблицы хранятся с кодами.
+        Таблица хранится списком кусков (датафрейм и его _TableIndex): добавленные строки становятся
+        новым куском, а куски сливаются так, что их размеры убывают геометрически (_merge_chunks).
+        Поэтому кусков O(log N), а каждая строка копируется при слияниях O(log N) раз.
+
         :param table_name_2_table (dict[str, pd.DataFrame]): словарь таблиц с данными.
             Пример, {
                 'sales': pd.DataFrame({'sale_id': ['123', ...], ...}),
                 ...
-            }. 
+            }.
+        :param user_dictionary (None, UserDictionary): словарь user_id, None - создать новый.
+        """
+        self.user_dictionary = user_dictionary if user_dictionary is not None else UserDictionary()
+        self.table_name_2_chunks = {}
+        self.table_name_2_version = {}
+        for table_name, table in table_name_2_table.items():
+            self.register_table(table_name, table)
+
+    @property
+    def table_names(self):
+        return list(self.table_name_2_chunks)
+
+    @property
+    def table_name_2_table(self):
+        """Словарь таблиц с исходными user_id, только для чтения.
+
+        Таблицы хранятся закодированными кусками, поэтому при каждом обращении собирается новая копия
+        всех таблиц (get_data_subset без фильтров). Для срезов данных используйте get_data_subset.
         """
-        self.table_name_2_table = table_name_2_table
+        return {table_name: self.get_data_subset(table_name, None, None) for table_name in self.table_names}
 
-    def get_data_subset(self, table_name, begin_date, end_date, user_ids=None, columns=None):
+    def register_table(self, table_name, table):
+        """Добавляет таблицу и строит по ней индекс по дате и user_id.
+
+        :param table_name (str): название таблицы с данными.
+        :param table (pd.DataFrame): таблица с данными.
+        """
+        table = self._encode_user_ids(table)
+        self.table_name_2_chunks[table_name] = [(table, _TableIndex(table))]
+        self._increment_version(table_name)
+
+    def get_table_version(self, table_name):
+        """Возвращает номер версии таблицы, который увеличивается при каждом изменении таблицы.
+
+        По нему сервисы, хранящие производные от таблицы данные (агрегаты, кеши), проверяют их актуальность.
+        """
+        return self.table_name_2_version.get(table_name, 0)
+
+    def _increment_version(self, table_name):
+        self.table_name_2_version[table_name] = self.get_table_version(table_name) + 1
+
+    def _encode_user_ids(self, table):
+        if 'user_id' not in table.columns:
+            return table
+        return table.assign(user_id=self.user_dictionary.encode(table['user_id']))
+
+    def _decode_user_ids(self, table):
+        if 'user_id' not in table.columns:
+            return table
+        return table.assign(user_id=self.user_dictionary.decode(table['user_id'].values))
+
+    def append_rows(self, table_name, rows, encoded=False):
+        """Дописывает строки в конец таблицы новым куском, время не зависит от размера таблицы (амортизированно).
+
+        :param table_name (str): название таблицы с данными.
+        :param rows (pd.DataFrame): новые строки таблицы.
+        :param encoded (bool): user_id в rows уже закодированы self.user_dictionary.
+        """
+        if rows.empty:
+            return
+        if not encoded:
+            rows = self._encode_user_ids(rows)
+        chunks = self.table_name_2_chunks[table_name]
+        if isinstance(chunks[0][0].index, pd.RangeIndex):
+            # Как pd.concat(..., ignore_index=True): строки нумеруются продолжением индекса таблицы
+            n_rows = sum(len(table) for table, _ in chunks)
+            rows = rows.set_axis(pd.RangeIndex(n_rows, n_rows + len(rows)))
+        chunks.append((rows, _TableIndex(rows)))
+        self._merge_chunks(chunks)
+        self._increment_version(table_name)
+
+    def _merge_chunks(self, chunks):
+        """Сливает последние куски таблицы, пока предпоследний меньше merge_factor * последний."""
+        while len(chunks) > 1 and len(chunks[-2][0]) < self.merge_factor * len(chunks[-1][0]):
+            rows, rows_index = chunks.pop()
+            table, index = chunks[-1]
+            if table.empty:
+                chunks[-1] = (rows, rows_index)
+                continue
+            table = pd.concat([table, rows])
+            chunks[-1] = (table, _TableIndex.extend(index, table, len(table) - len(rows)))
+
+    @instrument('data_service.get_data_subset')
+    def get_data_subset(self, table_name, begin_date, end_date, user_ids=None, columns=None, encoded=False):
         """Возвращает подмножество данных.
 
+        Фильтрация выполняется по индексу каждого куска таблицы: интервал дат превращается в непрерывный срез
+        отсортированных по дате позиций, а фильтр по user_id - в поиск позиций пользователей.
+        Порядок строк и индекс датафрейма такие же, как при фильтрации масками.
+
         :param table_name (str): название таблицы с данными.
         :param begin_date (datetime.datetime): дата начала интервала с данными.
             Пример, df[df['date'] >= begin_date].
@@ -32,24 +305,251 @@ class DataService:
         :param columns (None, list[str]): список названий столбцов, по которым нужно предоставить данные.
             Пример, df[columns].
             Если None, то фильтровать по columns не нужно.
+        :param encoded (bool): user_ids заданы кодами self.user_dictionary и в результате нужно оставить коды.
+            Используется сервисами внутри платформы.
 
         :return df (pd.DataFrame): датафрейм с подмножеством данных.
         """
-        if begin_date:
-            table = self.table_name_2_table[table_name][self.table_name_2_table[table_name]['date'] >= begin_date]
+        if has_user_filter(user_ids) and not encoded:
+            user_ids = self.user_dictionary.lookup(user_ids)
+        parts = [
+            self._get_chunk_subset(table, index, begin_date, end_date, user_ids, columns)
+            for table, index in self.table_name_2_chunks[table_name]
+        ]
+        non_empty_parts = [part for part in parts if len(part)]
+        if len(non_empty_parts) > 1:
+            table = pd.concat(non_empty_parts)
         else:
-            table = self.table_name_2_table[table_name]
+            table = non_empty_parts[0] if non_empty_parts else parts[0]
+
+        add_counters(rows_returned=len(table))
+        return table if encoded else self._decode_user_ids(table)
+
+    def iter_data_chunks(self, table_name, columns=None, encoded=False):
+        """Возвращает таблицу по частям, не больше read_chunk_size строк в части.
+
+        Нужен, чтобы обработать всю таблицу (например, построить агрегаты), не собирая её в один датафрейм.
+        Части не пересекаются и вместе содержат все строки таблицы.
+
+        :param table_name (str): название таблицы с данными.
+        :param columns (None, list[str]): список названий столбцов, None - все столбцы.
+        :param encoded (bool): оставить в результате коды user_id.
+        :return (iterator[pd.DataFrame]): части таблицы.
+        """
+        for table, _ in self.table_name_2_chunks[table_name]:
+            for lo in range(0, len(table), self.read_chunk_size):
+                part = table.iloc[lo:lo + self.read_chunk_size]
+                if columns:
+                    part = part[columns]
+                yield part if encoded else self._decode_user_ids(part)
+
+    def _get_chunk_subset(self, table, index, begin_date, end_date, user_ids, columns):
+        """Возвращает подмножество одного куска таблицы, user_ids - коды."""
+        filter_dates = bool(begin_date or end_date)
+        filter_users = has_user_filter(user_ids)
+        if (filter_dates and not index.has_dates) or (filter_users and not index.has_users):
+            add_counters(rows_scanned=len(table))
+            return self._get_data_subset_by_mask(table, begin_date, end_date, user_ids, columns)
+
+        if filter_users:
+            positions = index.get_user_positions(user_ids)
+            add_counters(rows_scanned=len(positions))
+            if filter_dates:
+                positions = positions[index.get_date_mask(positions, begin_date, end_date)]
+            table = table.iloc[positions]
+        elif filter_dates:
+            lo, hi = index.get_date_bounds(begin_date, end_date)
+            add_counters(rows_scanned=hi - lo)
+            if index.is_sorted:
+                table = table.iloc[lo:hi]
+            else:
+                table = table.iloc[np.sort(index.order[lo:hi])]
+        else:
+            add_counters(rows_scanned=len(table))
+
+        if columns:
+            table = table[columns]
+        return table
+
+    def _get_data_subset_by_mask(self, table, begin_date, end_date, user_ids=None, columns=None):
+        """Возвращает подмножество данных фильтрацией масками, для таблиц без индекса."""
+        if begin_date:
+            table = table[table['date'] >= begin_date]
 
         if end_date:
             table = table[table['date'] <= end_date]
 
-        if user_ids:
+        if has_user_filter(user_ids):
             table = table[table['user_id'].isin(user_ids)]
 
         if columns:
             table = table[columns]
 
         return table
-    
-    
 
+
+def _import_pyarrow():
+    """Импортирует pyarrow, который нужен только для хранения таблиц на диске."""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError as error:
+        raise ImportError('Для ParquetDataService нужен пакет pyarrow: pip install pyarrow') from error
+    return pyarrow
+
+
+class ParquetDataService(DataService):
+
+    partition_column = 'day'
+
+    def __init__(self, root_dir, table_name_2_table=None, memory_map=True, user_dictionary=None):
+        """Класс, предоставляющий доступ к сырым данным, которые хранятся на диске в формате Parquet.
+
+        Каждая таблица - это директория root_dir/<table_name>, разбитая на партиции по дням
+        (root_dir/<table_name>/day=YYYY-MM-DD/*.parquet), внутри партиции строки отсортированы по дате.
+        Таблицы открываются лениво при первом обращении, в память читаются только нужные
+        партиции, row group'ы и столбцы.
+
+        :param root_dir (str): директория с таблицами.
+        :param table_name_2_table (None, dict[str, pd.DataFrame]): таблицы, которые нужно записать на диск.
+            Если None, то используются таблицы, которые уже лежат в root_dir.
+        :param memory_map (bool): читать файлы через memory map.
+        :param user_dictionary (None, UserDictionary): словарь user_id, None - создать новый.
+            На диске user_id хранятся строками, кодируются при чтении.
+        """
+        self.user_dictionary = user_dictionary if user_dictionary is not None else UserDictionary()
+        self.pa = _import_pyarrow()
+        self.root_dir = root_dir
+        self.filesystem = self.pa.fs.LocalFileSystem(use_mmap=memory_map)
+        self.table_name_2_dataset = {}
+        self.table_name_2_version = {}
+        for table_name, table in (table_name_2_table or {}).items():
+            self.register_table(table_name, table)
+
+    @property
+    def table_names(self):
+        return sorted(
+            name for name in os.listdir(self.root_dir)
+            if os.path.isdir(os.path.join(self.root_dir, name))
+        )
+
+    def register_table(self, table_name, table, row_group_size=100_000):
+        """Записывает таблицу на диск с разбиением на партиции по дням.
+
+        :param table_name (str): название таблицы с данными.
+        :param table (pd.DataFrame): таблица с данными.
+        :param row_group_size (int): максимальное количество строк в row group.
+        """
+        shutil.rmtree(os.path.join(self.root_dir, table_name), ignore_errors=True)
+        self._write_table(table_name, table, row_group_size)
+
+    def append_rows(self, table_name, rows, encoded=False, row_group_size=100_000):
+        """Дописывает строки в таблицу новыми файлами в партициях соответствующих дней.
+
+        :param table_name (str): название таблицы с данными.
+        :param rows (pd.DataFrame): новые строки таблицы.
+        :param encoded (bool): user_id в rows закодированы self.user_dictionary.
+        :param row_group_size (int): максимальное количество строк в row group.
+        """
+        if encoded:
+            rows = self._decode_user_ids(rows)
+        self._write_table(table_name, rows, row_group_size)
+
+    def _write_table(self, table_name, table, row_group_size):
+        pa = self.pa
+        partitioning = None
+        if 'date' in table.columns:
+            table = table.sort_values('date', kind='stable')
+            table = table.assign(**{self.partition_column: table['date'].dt.strftime('%Y-%m-%d')})
+            partitioning = pa.dataset.partitioning(
+                pa.schema([(self.partition_column, pa.string())]), flavor='hive'
+            )
+        pa.dataset.write_dataset(
+            pa.Table.from_pandas(table, preserve_index=False),
+            base_dir=f'{self.root_dir}/{table_name}',
+            format='parquet',
+            partitioning=partitioning,
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+            max_rows_per_group=row_group_size,
+            min_rows_per_group=min(row_group_size, len(table)),
+        )
+        self.table_name_2_dataset.pop(table_name, None)
+        self._increment_version(table_name)
+
+    def _get_dataset(self, table_name):
+        if table_name not in self.table_name_2_dataset:
+            self.table_name_2_dataset[table_name] = self.pa.dataset.dataset(
+                f'{self.root_dir}/{table_name}',
+                format='parquet',
+                partitioning='hive',
+                filesystem=self.filesystem,
+            )
+        return self.table_name_2_dataset[table_name]
+
+    def _make_filter(self, dataset, begin_date, end_date, user_ids):
+        """Собирает условие для pyarrow, которое отбрасывает лишние партиции и row group'ы."""
+        pa, field = self.pa, self.pa.dataset.field
+        conditions = []
+        has_partitions = self.partition_column in dataset.schema.names
+        if begin_date or end_date:
+            date_type = dataset.schema.field('date').type
+        if begin_date:
+            if has_partitions:
+                conditions.append(field(self.partition_column) >= pd.Timestamp(begin_date).strftime('%Y-%m-%d'))
+            conditions.append(field('date') >= pa.scalar(pd.Timestamp(begin_date), type=date_type))
+        if end_date:
+            if has_partitions:
+                conditions.append(field(self.partition_column) <= pd.Timestamp(end_date).strftime('%Y-%m-%d'))
+            conditions.append(field('date') <= pa.scalar(pd.Timestamp(end_date), type=date_type))
+        if has_user_filter(user_ids):
+            conditions.append(field('user_id').isin(list(set(user_ids))))
+        if not conditions:
+            return None
+        condition = conditions[0]
+        for other in conditions[1:]:
+            condition = condition & other
+        return condition
+
+    @instrument('data_service.get_data_subset')
+    def get_data_subset(self, table_name, begin_date, end_date, user_ids=None, columns=None, encoded=False):
+        """Возвращает подмножество данных, прочитанное с диска.
+
+        Условия на даты, user_id и список столбцов передаются в pyarrow, поэтому читаются только
+        подходящие партиции, row group'ы и столбцы. Параметры такие же, как у DataService.get_data_subset,
+        индекс результата - RangeIndex.
+
+        :return df (pd.DataFrame): датафрейм с подмножеством данных.
+        """
+        dataset = self._get_dataset(table_name)
+        if not columns:
+            columns = [name for name in dataset.schema.names if name != self.partition_column]
+        if encoded and has_user_filter(user_ids):
+            user_ids = np.asarray(user_ids)
+            user_ids = self.user_dictionary.decode(user_ids[user_ids >= 0])
+            if len(user_ids) == 0:
+                # Все пользователи неизвестны словарю, значит и на диске их нет
+                table = dataset.schema.empty_table().select(list(columns)).to_pandas()
+                return self._encode_user_ids(table)
+        table = dataset.to_table(
+            columns=list(columns),
+            filter=self._make_filter(dataset, begin_date, end_date, user_ids),
+        )
+        table = table.to_pandas()
+        add_counters(rows_returned=len(table))
+        return self._encode_user_ids(table) if encoded else table
+
+    def iter_data_chunks(self, table_name, columns=None, encoded=False):
+        """Возвращает таблицу с диска по частям, параметры такие же, как у DataService.iter_data_chunks.
+
+        Части читаются потоком batch'ей pyarrow, в памяти одновременно только несколько частей.
+        """
+        dataset = self._get_dataset(table_name)
+        if not columns:
+            columns = [name for name in dataset.schema.names if name != self.partition_column]
+        for batch in dataset.to_batches(columns=list(columns), batch_size=self.read_chunk_size):
+            if batch.num_rows == 0:
+                continue
+            table = batch.to_pandas()
+            yield self._encode_user_ids(table) if encoded else table
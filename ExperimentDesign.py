@@ -1,21 +1,39 @@
 from pydantic import BaseModel
+from typing import Any, Dict, Optional
 
 
 class Design(BaseModel):
     """Дата-класс с описание параметров эксперимента.
 
-    statistical_test - тип статтеста. ['ttest', 'bootstrap']
+    statistical_test - тип статтеста. ['ttest', 'bootstrap', 'stratified ttest', 'cuped ttest']
+        'stratified ttest' - группы со столбцом 'strata', 'cuped ttest' - со столбцом 'covariate'
+        (значение метрики в предэкспериментальном периоде).
     effect - размер эффекта в процентах
     alpha - уровень значимости
     beta - допустимая вероятность ошибки II рода
     bootstrap_iter - количество итераций бутстрепа
     bootstrap_ci_type - способ построения доверительного интервала. ['normal', 'percentile', 'pivotal']
-    bootstrap_agg_func - метрика эксперимента. ['mean', 'quantile 95']
+    bootstrap_agg_func - метрика эксперимента. ['mean', 'quantile q'], например 'quantile 95' - 95-ый перцентиль
+    bootstrap_engine - способ генерации бутстрепных выборок. ['resample', 'poisson', 'multinomial', 'rank', 'sketch']
+        'resample' - материализуем матрицу подвыборок размера (len(data), bootstrap_iter),
+        'poisson', 'multinomial' - проходим по данным блоками, каждому значению сопоставляем вес
+        (Poisson(1) или число попаданий в подвыборку), память ограничена bootstrap_chunk_size * bootstrap_iter.
+        Только для bootstrap_agg_func='mean'.
+        'rank' - сортируем группу один раз и генерируем порядковые статистики подвыборок, точный по распределению.
+        'sketch' - как 'rank', но вместо сортированной группы используем QuantileSketch, приближённый.
+        Не быстрее 'rank', но не создаёт отсортированную копию группы, память O(bootstrap_sketch_size * log2(n)).
+        Только для bootstrap_agg_func='quantile q'.
+    bootstrap_chunk_size - размер блока данных для bootstrap_engine 'poisson' и 'multinomial'
+    bootstrap_sketch_size - параметр k скетча для bootstrap_engine='sketch', ошибка ранга порядка log2(n / k) / k
     metric_name - название целевой метрики эксперимента
     metric_outlier_lower_bound - нижняя допустимая граница метрики, всё что ниже считаем выбросами
     metric_outlier_upper_bound - верхняя допустимая граница метрики, всё что выше считаем выбросами
     metric_outlier_process_type - способ обработки выбросов. ['drop', 'clip'].
         'drop' - удаляем измерение, 'clip' - заменяем выброс на значение ближайшей границы (lower_bound, upper_bound).
+    sample_size - размер групп (количество пользователей в группе) для оценки вероятностей ошибок
+    strata_weights - веса страт для 'stratified ttest', None - доли страт в данных.
+        Ключи - значения столбца 'strata' того же типа (например, int), вес задаётся для каждой страты в данных,
+        страты с весом 0 не учитываются.
     """
     statistical_test: str = 'ttest'
     effect: float = 3.
@@ -24,7 +42,12 @@ class Design(BaseModel):
     bootstrap_iter: int = 1000
     bootstrap_ci_type: str = 'normal'
     bootstrap_agg_func: str = 'mean'
+    bootstrap_engine: str = 'resample'
+    bootstrap_chunk_size: int = 4096
+    bootstrap_sketch_size: int = 1024
     metric_name: str
     metric_outlier_lower_bound: float
     metric_outlier_upper_bound: float
-    metric_outlier_process_type: str
\ No newline at end of file
+    metric_outlier_process_type: str
+    sample_size: Optional[int] = None
+    strata_weights: Optional[Dict[Any, float]] = None
@@ -1,10 +1,30 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
 import numpy as np
 import pandas as pd
 from scipy import stats
 
+from Instrumentation import add_counters, instrument
+from QuantileSketch import QuantileSketch
+
 
 class ExperimentsService:
 
+    # Ограничение на количество случайных чисел и значений метрик, которые обрабатываются
+    # за один векторный вызов при генерации групп.
+    group_batch_size = 2 ** 22
+    # Количество итераций, для которых t-test считается одним векторным вызовом.
+    ttest_batch_iter = 1024
+
+    def __init__(self, random_state=None):
+        """Класс для проведения экспериментов.
+
+        :param random_state (None, int, np.random.SeedSequence, np.random.Generator): начальное состояние
+            генератора случайных чисел. При фиксированном значении результаты симуляций воспроизводимы.
+        """
+        self.rng = np.random.default_rng(random_state)
+
     def estimate_sample_size(self, metrics, design):
         """Оцениваем необходимый размер выборки для проверки гипотезы о равенстве средних.
         
@@ -15,8 +35,12 @@ class ExperimentsService:
             302 наблюдения, то размер групп будет 31, тк в среднем на одного пользователя 10 наблюдений, то получится
             порядка 310 наблюдений в группе.
 
+        Для 'stratified ttest' вместо дисперсии метрики используется внутристратовая дисперсия
+        sum(w_k * var_k), для 'cuped ttest' - дисперсия var * (1 - corr(metric, covariate) ** 2).
+
         :param metrics (pd.DataFrame): датафрейм со значениями метрик из MetricsService.
-            columns=['user_id', 'metric']
+            columns=['user_id', 'metric'], для 'stratified ttest' нужен столбец 'strata',
+            для 'cuped ttest' - столбец 'covariate'.
         :param design (Design): объект с данными, описывающий параметры эксперимента
         :return (int): минимально необходимый размер групп (количество пользователей)
         """
@@ -25,15 +49,82 @@ class ExperimentsService:
         t_alpha = stats.norm.ppf(1 - design.alpha / 2, loc=0, scale=1)
         t_beta = stats.norm.ppf(1 - design.beta, loc=0, scale=1)
         z_scores_sum_squared = (t_alpha + t_beta) ** 2
-        std = np.std(metrics.metric)
+        variance = self._get_sample_size_variance(metrics, design)
 
         sample_size = int(
             np.ceil(
-                z_scores_sum_squared * (2 * std ** 2) / (epsilon ** 2)  / nums_per_user
+                z_scores_sum_squared * (2 * variance) / (epsilon ** 2)  / nums_per_user
             )
         )
         return sample_size
+
+    def _get_sample_size_variance(self, metrics, design):
+        """Возвращает дисперсию метрики для оценки размера выборки с учётом способа снижения дисперсии."""
+        if design.statistical_test == 'stratified ttest':
+            strata_stats = self._aggregate_stats([metrics], by=['strata']).loc[0]
+            weights = self._get_strata_weights(strata_stats['count'], design)
+            # Дисперсия внутри страт с ddof=0, как np.std для остальных тестов
+            strata_variance = strata_stats['sum_sq'] / strata_stats['count'] - (strata_stats['sum'] / strata_stats['count']) ** 2
+            return (weights * strata_variance).sum()
+        elif design.statistical_test == 'cuped ttest':
+            correlation = metrics['metric'].corr(metrics['covariate'])
+            return np.var(metrics['metric']) * (1 - correlation ** 2)
+        return np.std(metrics.metric) ** 2
     
+    def _build_user_index(self, metrics):
+        """Группирует значения метрик по пользователям в формате CSR.
+
+        Значения пользователя с номером i - это values[offsets[i]:offsets[i + 1]].
+
+        :param metrics (pd.DataFame): таблица с метриками, columns=['user_id', 'metric'].
+        :return offsets (np.array), values (np.array): границы значений пользователей и значения метрик.
+        """
+        # Пустой user_id - отдельный пользователь, как при выборе из metrics['user_id'].unique()
+        codes, user_ids = pd.factorize(metrics['user_id'], use_na_sentinel=False)
+        order = np.argsort(codes, kind='stable')
+        values = metrics['metric'].values[order]
+        offsets = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(user_ids)), out=offsets[1:])
+        return offsets, values
+
+    def _sample_group_batches(self, offsets, values, sample_size, n_iter, rng=None):
+        """Генерирует случайные группы пачками по несколько итераций.
+
+        Для пачки из n итераций пользователи групп выбираются одним векторным вызовом: каждому
+        пользователю в каждой итерации сопоставляется случайное число, в группу A попадают sample_size
+        пользователей с наименьшими числами, в группу B - следующие sample_size. Значения метрик
+        собираются по индексу offsets одной операцией.
+
+        :param offsets, values (np.array): значения метрик, сгруппированные по пользователям (_build_user_index).
+        :param sample_size (int): размер групп (количество пользователей в группе).
+        :param n_iter (int): количество итераций генерирования случайных групп.
+        :param rng (None, np.random.Generator): генератор случайных чисел, None - self.rng.
+        :return (generator[np.array, np.array]): пары (group_values, group_bounds) для каждой пачки:
+            значения группы A итерации i - group_values[group_bounds[2 * i]:group_bounds[2 * i + 1]],
+            значения группы B - group_values[group_bounds[2 * i + 1]:group_bounds[2 * i + 2]].
+        """
+        rng = self.rng if rng is None else rng
+        counts = np.diff(offsets)
+        n_users = len(counts)
+        if 2 * sample_size > n_users:
+            raise ValueError('Размер групп больше половины количества пользователей')
+        values_per_iter = 2 * sample_size * max(1., len(values) / max(n_users, 1))
+        batch_iter = int(max(1, min(self.group_batch_size // max(n_users, 1), self.group_batch_size // values_per_iter)))
+
+        for batch_begin in range(0, n_iter, batch_iter):
+            n = min(batch_iter, n_iter - batch_begin)
+            keys = rng.random((n, n_users))
+            users = np.argpartition(keys, 2 * sample_size - 1, axis=1)[:, :2 * sample_size]
+            user_keys = np.take_along_axis(keys, users, axis=1)
+            users = np.take_along_axis(users, np.argpartition(user_keys, sample_size - 1, axis=1), axis=1)
+            users = users.reshape(-1)
+
+            user_counts = counts[users]
+            user_ends = np.cumsum(user_counts)
+            positions = np.repeat(offsets[users] - user_ends + user_counts, user_counts) + np.arange(user_ends[-1])
+            group_bounds = np.concatenate([[0], user_ends[sample_size - 1::sample_size]])
+            yield values[positions], group_bounds
+
     def _create_group_generator(self, metrics, sample_size, n_iter):
         """Генератор случайных групп.
 
@@ -42,12 +133,17 @@ class ExperimentsService:
         :param n_iter (int): количество итераций генерирования случайных групп.
         :return (np.array, np.array): два массива со значениями метрик в группах.
         """
-        user_ids = metrics['user_id'].unique()
-        for _ in range(n_iter):
-            a_user_ids, b_user_ids = np.random.choice(user_ids, (2, sample_size), False)
-            a_metric_values = metrics.loc[metrics['user_id'].isin(a_user_ids), 'metric'].values
-            b_metric_values = metrics.loc[metrics['user_id'].isin(b_user_ids), 'metric'].values
-            yield a_metric_values, b_metric_values
+        offsets, values = self._build_user_index(metrics)
+        yield from self._iterate_groups(self._sample_group_batches(offsets, values, sample_size, n_iter))
+
+    def _iterate_groups(self, group_batches):
+        """Разбивает пачки групп из _sample_group_batches на пары (a_values, b_values) по итерациям."""
+        for group_values, group_bounds in group_batches:
+            for i in range(0, len(group_bounds) - 1, 2):
+                yield (
+                    group_values[group_bounds[i]:group_bounds[i + 1]],
+                    group_values[group_bounds[i + 1]:group_bounds[i + 2]],
+                )
 
     def _estimate_errors(self, group_generator, design, effect_add_type):
         """Оцениваем вероятности ошибок I и II рода.
@@ -61,7 +157,9 @@ class ExperimentsService:
             - pvalues_aa, pvalues_ab - списки со значениями pvalue
             - first_type_error, second_type_error - оценки вероятностей ошибок I и II рода.
         """
-        # YOUR_CODE_HERE
+        if design.statistical_test == 'ttest':
+            return self._estimate_errors_ttest(group_generator, design, effect_add_type)
+
         pvalues_aa = []
         pvalues_ab = []
         for gr_a, gr_b in group_generator:
@@ -78,6 +176,76 @@ class ExperimentsService:
 
         return pvalues_aa, pvalues_ab, first_type_error, second_type_error
     
+    def _get_group_stats(self, group_values, group_bounds):
+        """Вычисляет достаточные статистики групп, записанных подряд в одном массиве.
+
+        :param group_values (np.array): значения метрик всех групп.
+        :param group_bounds (np.array): границы групп, значения группы i -
+            group_values[group_bounds[i]:group_bounds[i + 1]].
+        :return counts, means, m2 (np.array): количество значений, среднее и сумма квадратов
+            отклонений от среднего в каждой группе.
+        """
+        counts = np.diff(group_bounds)
+        # Номер группы каждого значения, пустые группы просто не встречаются
+        group_ids = np.repeat(np.arange(len(counts)), counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.bincount(group_ids, weights=group_values, minlength=len(counts)) / counts
+            deviations = group_values - means[group_ids]
+            m2 = np.where(counts > 0, np.bincount(group_ids, weights=deviations ** 2, minlength=len(counts)), np.nan)
+        return counts, means, m2
+
+    def _get_ttest_pvalues(self, count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+        """Вычисляет pvalue t-test'а с равными дисперсиями (как stats.ttest_ind) по статистикам групп.
+
+        Все параметры могут быть массивами, тогда pvalue считаются поэлементно.
+
+        :param count_a, count_b: количество значений в группах.
+        :param mean_a, mean_b: средние значения в группах.
+        :param m2_a, m2_b: суммы квадратов отклонений от среднего в группах.
+        :return (np.array): значения pvalue.
+        """
+        dof = count_a + count_b - 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pooled_var = (m2_a + m2_b) / dof
+            t = (mean_a - mean_b) / np.sqrt(pooled_var * (1 / count_a + 1 / count_b))
+            return 2 * stats.t.sf(np.abs(t), dof)
+
+    def _estimate_errors_ttest(self, group_generator, design, effect_add_type):
+        """Оцениваем вероятности ошибок I и II рода для t-test'а векторно.
+
+        Группы обрабатываются пачками по ttest_batch_iter итераций: для пачки считаются количество,
+        среднее и сумма квадратов отклонений каждой группы, эффект добавляется к статистикам группы B,
+        и все pvalue AA и AB считаются одним вызовом. Параметры и результат как у _estimate_errors.
+        """
+        if effect_add_type not in ('all_const', 'all_percent'):
+            raise ValueError('Неверное значение effect_add_type')
+
+        pvalues_aa = []
+        pvalues_ab = []
+        while True:
+            groups = [group for pair in islice(group_generator, self.ttest_batch_iter) for group in pair]
+            if not groups:
+                break
+            group_bounds = np.concatenate([[0], np.cumsum([len(group) for group in groups])])
+            counts, means, m2 = self._get_group_stats(np.concatenate(groups), group_bounds)
+            count_a, mean_a, m2_a = counts[0::2], means[0::2], m2[0::2]
+            count_b, mean_b, m2_b = counts[1::2], means[1::2], m2[1::2]
+            pvalues_aa.append(self._get_ttest_pvalues(count_a, mean_a, m2_a, count_b, mean_b, m2_b))
+
+            if effect_add_type == 'all_const':
+                mean_b = mean_b + mean_b * (design.effect / 100)
+            if effect_add_type == 'all_percent':
+                mean_b = mean_b * (1 + design.effect / 100)
+                m2_b = m2_b * (1 + design.effect / 100) ** 2
+            pvalues_ab.append(self._get_ttest_pvalues(count_a, mean_a, m2_a, count_b, mean_b, m2_b))
+
+        pvalues_aa = np.concatenate(pvalues_aa) if pvalues_aa else np.array([])
+        pvalues_ab = np.concatenate(pvalues_ab) if pvalues_ab else np.array([])
+        first_type_error = pd.Series(pvalues_aa <= design.alpha).mean()
+        second_type_error = pd.Series(pvalues_ab >= design.alpha).mean()
+        return pvalues_aa.tolist(), pvalues_ab.tolist(), first_type_error, second_type_error
+
+    @instrument('experiments.estimate_errors')
     def estimate_errors(self, metrics, design, effect_add_type, n_iter):
         """Оцениваем вероятности ошибок I и II рода.
 
@@ -91,9 +259,137 @@ class ExperimentsService:
             - pvalues_aa, pvalues_ab - списки со значениями pvalue
             - first_type_error, second_type_error - оценки вероятностей ошибок I и II рода.
         """
+        add_counters(rows_scanned=len(metrics))
         group_generator = self._create_group_generator(metrics, design.sample_size, n_iter)
-        return self._estimate_errors(group_generator, design, effect_add_type)
+        pvalues_aa, pvalues_ab, first_type_error, second_type_error = self._estimate_errors(
+            group_generator, design, effect_add_type
+        )
+        add_counters(iterations=len(pvalues_aa))
+        return pvalues_aa, pvalues_ab, first_type_error, second_type_error
+
+    def _get_wilson_interval(self, successes, n, z):
+        """Доверительный интервал Уилсона для вероятности успеха.
+
+        :param successes (int): количество успехов.
+        :param n (int): количество испытаний.
+        :param z (float): квантиль нормального распределения для уровня доверия.
+        :return left, right (float): границы интервала.
+        """
+        rate = successes / n
+        denominator = 1 + z ** 2 / n
+        center = (rate + z ** 2 / (2 * n)) / denominator
+        half_width = z / denominator * np.sqrt(rate * (1 - rate) / n + z ** 2 / (4 * n ** 2))
+        return center - half_width, center + half_width
+
+    @instrument('experiments.estimate_errors_adaptive')
+    def estimate_errors_adaptive(self, metrics, design, effect_add_type, max_iter,
+                                 precision=0.01, confidence=0.95, block_iter=500):
+        """Оцениваем вероятности ошибок I и II рода с ранней остановкой.
+
+        Симуляции выполняются блоками по block_iter итераций. После каждого блока для обеих вероятностей
+        строится доверительный интервал Уилсона. Вероятность считается определённой, если полуширина
+        интервала не больше precision или интервал целиком лежит по одну сторону от допустимого уровня
+        (alpha для ошибки I рода, beta для ошибки II рода). Симуляции останавливаются, когда определены
+        обе вероятности или выполнено max_iter итераций.
+
+        :param metrics (pd.DataFame): таблица с метриками, columns=['user_id', 'metric'].
+        :param design (Design): объект с данными, описывающий параметры эксперимента.
+        :param effect_add_type (str): способ добавления эффекта для группы B, как в estimate_errors.
+        :param max_iter (int): максимальное количество итераций генерирования случайных групп.
+        :param precision (float): требуемая полуширина доверительных интервалов вероятностей ошибок.
+        :param confidence (float): уровень доверия интервалов.
+        :param block_iter (int): количество итераций между проверками условия остановки.
+        :return pvalues_aa (list[float]), pvalues_ab (list[float]), first_type_error (float), second_type_error (float), n_iter (int):
+            - pvalues_aa, pvalues_ab - списки со значениями pvalue
+            - first_type_error, second_type_error - оценки вероятностей ошибок I и II рода.
+            - n_iter - количество выполненных итераций.
+        """
+        z = stats.norm.ppf(1 - (1 - confidence) / 2)
+        group_generator = self._create_group_generator(metrics, design.sample_size, max_iter)
+        pvalues_aa = []
+        pvalues_ab = []
+        while len(pvalues_aa) < max_iter:
+            block_pvalues_aa, block_pvalues_ab, _, _ = self._estimate_errors(
+                islice(group_generator, block_iter), design, effect_add_type
+            )
+            if not block_pvalues_aa:
+                break
+            pvalues_aa.extend(block_pvalues_aa)
+            pvalues_ab.extend(block_pvalues_ab)
+
+            n_iter = len(pvalues_aa)
+            is_resolved = []
+            for errors, max_error in (
+                (np.sum(np.asarray(pvalues_aa) <= design.alpha), design.alpha),
+                (np.sum(np.asarray(pvalues_ab) >= design.alpha), design.beta),
+            ):
+                left, right = self._get_wilson_interval(errors, n_iter, z)
+                is_resolved.append((right - left) / 2 <= precision or left > max_error or right < max_error)
+            if all(is_resolved):
+                break
+
+        first_type_error = pd.Series(np.asarray(pvalues_aa) <= design.alpha, dtype=float).mean()
+        second_type_error = pd.Series(np.asarray(pvalues_ab) >= design.alpha, dtype=float).mean()
+        add_counters(rows_scanned=len(metrics), iterations=len(pvalues_aa))
+        return pvalues_aa, pvalues_ab, first_type_error, second_type_error, len(pvalues_aa)
+
+    @instrument('experiments.estimate_errors_grid')
+    def estimate_errors_grid(self, metrics, designs, effect_add_type, n_iter, random_state=None, n_jobs=1, block_iter=256):
+        """Оцениваем вероятности ошибок I и II рода для набора дизайнов.
+
+        Итерации делятся на блоки по block_iter. Для каждого размера групп и номера блока из
+        np.random.SeedSequence(random_state) детерминированно получается свой генератор случайных чисел,
+        группы блока генерируются один раз и используются всеми дизайнами с этим размером групп.
+        Блоки считаются параллельно в n_jobs процессах, результат не зависит от n_jobs.
+
+        :param metrics (pd.DataFame): таблица с метриками, columns=['user_id', 'metric'].
+        :param designs (list[Design]): дизайны экспериментов, у каждого должен быть задан sample_size.
+        :param effect_add_type (str): способ добавления эффекта для группы B, как в estimate_errors.
+        :param n_iter (int): количество итераций генерирования случайных групп для каждого дизайна.
+        :param random_state (None, int): начальное состояние генераторов случайных чисел.
+        :param n_jobs (int): количество процессов.
+        :param block_iter (int): количество итераций в блоке.
+        :return (pd.DataFrame): по строке на дизайн, параметры дизайна и столбцы
+            first_type_error, second_type_error, n_iter.
+        """
+        if any(design.sample_size is None for design in designs):
+            raise ValueError('У всех дизайнов должен быть задан sample_size')
+        entropy = np.random.SeedSequence(random_state).entropy
+        # Дизайны хранятся номерами в designs, один и тот же объект Design может встречаться несколько раз
+        sample_size_2_design_ids = {}
+        for design_id, design in enumerate(designs):
+            sample_size_2_design_ids.setdefault(design.sample_size, []).append(design_id)
+
+        tasks = []
+        for sample_size, design_ids in sample_size_2_design_ids.items():
+            sample_size_designs = [designs[design_id] for design_id in design_ids]
+            for block, block_begin in enumerate(range(0, n_iter, block_iter)):
+                seed = np.random.SeedSequence(entropy, spawn_key=(sample_size, block))
+                tasks.append((sample_size, sample_size_designs, effect_add_type, min(block_iter, n_iter - block_begin), seed))
+
+        offsets, values = self._build_user_index(metrics)
+        if n_jobs == 1:
+            results = [_estimate_grid_block(offsets, values, *task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(n_jobs, initializer=_init_grid_worker, initargs=(offsets, values)) as executor:
+                results = list(executor.map(_estimate_grid_block_in_worker, tasks))
+
+        design_errors = np.zeros((len(designs), 2), dtype=np.int64)
+        for (sample_size, _, _, _, _), block_errors in zip(tasks, results):
+            for design_id, errors in zip(sample_size_2_design_ids[sample_size], block_errors):
+                design_errors[design_id] += errors
+        add_counters(rows_scanned=len(metrics), iterations=n_iter * len(designs))
+        return pd.DataFrame([
+            {
+                **dict(design),
+                'first_type_error': design_errors[design_id][0] / n_iter,
+                'second_type_error': design_errors[design_id][1] / n_iter,
+                'n_iter': n_iter,
+            }
+            for design_id, design in enumerate(designs)
+        ])
     
+    @instrument('experiments.bootstrap')
     def _generate_bootstrap_metrics(self, data_one, data_two, design):
         """Генерирует значения метрики, полученные с помощью бутстрепа.
         
@@ -103,22 +399,148 @@ class ExperimentsService:
             bootstrap_metrics (np.array) - значения статистики теста псчитанное по бутстрепным подвыборкам
             pe_metric (float) - значение статистики теста посчитанное по исходным данным
         """
-        bootstrap_data_one = np.random.choice(data_one, (len(data_one), design.bootstrap_iter))
-        bootstrap_data_two = np.random.choice(data_two, (len(data_two), design.bootstrap_iter))
-        if design.bootstrap_agg_func == 'mean':
+        add_counters(rows_scanned=len(data_one) + len(data_two), iterations=design.bootstrap_iter)
+        if design.bootstrap_engine in ('poisson', 'multinomial'):
+            return self._generate_weighted_bootstrap_metrics(data_one, data_two, design)
+        elif design.bootstrap_engine in ('rank', 'sketch'):
+            return self._generate_quantile_bootstrap_metrics(data_one, data_two, design)
+        elif design.bootstrap_engine != 'resample':
+            raise ValueError('Неверное значение design.bootstrap_engine')
+
+        quantile = self._get_bootstrap_quantile(design)
+        bootstrap_data_one = self.rng.choice(data_one, (len(data_one), design.bootstrap_iter))
+        bootstrap_data_two = self.rng.choice(data_two, (len(data_two), design.bootstrap_iter))
+        if quantile is None:
             bootstrap_metrics = bootstrap_data_two.mean(axis=0) - bootstrap_data_one.mean(axis=0)
             pe_metric = data_two.mean() - data_one.mean()
             return bootstrap_metrics, pe_metric
-        elif design.bootstrap_agg_func == 'quantile 95':
+        else:
             bootstrap_metrics = (
-                np.quantile(bootstrap_data_two, 0.95, axis=0)
-                - np.quantile(bootstrap_data_one, 0.95, axis=0)
+                np.quantile(bootstrap_data_two, quantile, axis=0)
+                - np.quantile(bootstrap_data_one, quantile, axis=0)
             )
-            pe_metric = np.quantile(data_two, 0.95) - np.quantile(data_one, 0.95)
+            pe_metric = np.quantile(data_two, quantile) - np.quantile(data_one, quantile)
             return bootstrap_metrics, pe_metric
-        else:
+
+    def _get_bootstrap_quantile(self, design):
+        """Возвращает уровень квантиля из design.bootstrap_agg_func.
+
+        :return (None, float): None для 'mean', q / 100 для 'quantile q', например 0.95 для 'quantile 95'.
+        """
+        if design.bootstrap_agg_func == 'mean':
+            return None
+        agg_func, _, level = design.bootstrap_agg_func.partition(' ')
+        try:
+            quantile = float(level) / 100
+        except ValueError:
+            quantile = np.nan
+        if agg_func != 'quantile' or not 0 <= quantile <= 1:
             raise ValueError('Неверное значение design.bootstrap_agg_func')
-        
+        return quantile
+
+    def _get_bootstrap_quantiles(self, n, quantile, get_values_at_ranks, n_iter):
+        """Вычисляет квантили бутстрепных подвыборок без генерации самих подвыборок.
+
+        np.quantile с линейной интерполяцией берёт порядковые статистики подвыборки с номерами j и j + 1,
+        j = floor((n - 1) * quantile). Подвыборку можно получить как floor(n * U_i) - номера в
+        отсортированных данных для n независимых U_i ~ U(0, 1), поэтому её k-ая порядковая статистика -
+        это значение с номером floor(n * U_(k)) в отсортированных данных. U_(k) ~ Beta(k, n - k + 1),
+        а при известном U_(k) следующая статистика U_(k+1) = U_(k) + (1 - U_(k)) * Beta(1, n - k).
+        Поэтому на итерацию нужно два случайных числа вместо n.
+
+        :param n (int): размер группы.
+        :param quantile (float): уровень квантиля.
+        :param get_values_at_ranks (callable): возвращает значения по номерам в отсортированных данных.
+        :param n_iter (int): количество бутстрепных подвыборок.
+        :return (np.array): квантили n_iter подвыборок.
+        """
+        position = (n - 1) * quantile
+        lower = int(np.floor(position))
+        u_lower = self.rng.beta(lower + 1, n - lower, n_iter)
+        if lower + 1 < n:
+            u_upper = u_lower + (1 - u_lower) * self.rng.beta(1, n - lower - 1, n_iter)
+        else:
+            u_upper = u_lower
+        lower_values = get_values_at_ranks(np.minimum((n * u_lower).astype(np.int64), n - 1))
+        upper_values = get_values_at_ranks(np.minimum((n * u_upper).astype(np.int64), n - 1))
+        return lower_values + (position - lower) * (upper_values - lower_values)
+
+    def _generate_quantile_bootstrap_metrics(self, data_one, data_two, design):
+        """Генерирует значения квантильной метрики бутстрепом по порядковым статистикам.
+
+        bootstrap_engine='rank' - точный по распределению бутстреп: каждая группа сортируется один раз,
+            квантили подвыборок вычисляются за O(bootstrap_iter) (_get_bootstrap_quantiles).
+        bootstrap_engine='sketch' - приближённый бутстреп для групп, отсортированная копия которых не помещается
+            в память: группа сжимается в QuantileSketch размера bootstrap_sketch_size, ошибка ранга не больше
+            QuantileSketch.rank_error * len(data).
+
+        Параметры и результат как у _generate_bootstrap_metrics.
+        """
+        quantile = self._get_bootstrap_quantile(design)
+        if quantile is None:
+            raise ValueError('Бутстреп по порядковым статистикам поддерживает только bootstrap_agg_func=\'quantile q\'')
+
+        group_metrics = []
+        for data in (data_one, data_two):
+            if design.bootstrap_engine == 'rank':
+                sorted_data = np.sort(data)
+                get_values_at_ranks = sorted_data.__getitem__
+                pe_metric = np.quantile(sorted_data, quantile)
+            else:
+                sketch = QuantileSketch(design.bootstrap_sketch_size, self.rng).update(data)
+                get_values_at_ranks = sketch.get_values_at_ranks
+                pe_metric = sketch.quantile(quantile)
+            bootstrap_metrics = self._get_bootstrap_quantiles(len(data), quantile, get_values_at_ranks, design.bootstrap_iter)
+            group_metrics.append((bootstrap_metrics, pe_metric))
+
+        (bootstrap_metrics_one, pe_metric_one), (bootstrap_metrics_two, pe_metric_two) = group_metrics
+        return bootstrap_metrics_two - bootstrap_metrics_one, pe_metric_two - pe_metric_one
+
+    def _get_weighted_bootstrap_means(self, data, design):
+        """Вычисляет средние бутстрепных подвыборок, проходя по данным блоками.
+
+        Подвыборка задаётся весами значений: для 'poisson' веса независимы и распределены как Poisson(1),
+        для 'multinomial' веса - это количество попаданий значения в подвыборку размера len(data).
+        Для 'multinomial' число попаданий в блок генерируется биномиальным распределением из оставшихся
+        попаданий, а внутри блока распределяется мультиномиально, поэтому результат совпадает по
+        распределению с обычным бутстрепом.
+        В памяти одновременно находится матрица весов размера (bootstrap_iter, bootstrap_chunk_size).
+
+        :param data (np.array): значения метрики в группе.
+        :param design (Design): объект с данными, описывающий параметры эксперимента
+        :return (np.array): средние значения в bootstrap_iter подвыборках.
+        """
+        data = np.asarray(data, dtype=float)
+        weighted_sums = np.zeros(design.bootstrap_iter)
+        weights_sums = np.zeros(design.bootstrap_iter)
+        remaining_trials = np.full(design.bootstrap_iter, len(data))
+        for chunk_begin in range(0, len(data), design.bootstrap_chunk_size):
+            chunk = data[chunk_begin:chunk_begin + design.bootstrap_chunk_size]
+            if design.bootstrap_engine == 'poisson':
+                weights = self.rng.poisson(1., (design.bootstrap_iter, len(chunk)))
+            else:
+                chunk_trials = self.rng.binomial(remaining_trials, len(chunk) / (len(data) - chunk_begin))
+                remaining_trials -= chunk_trials
+                weights = self.rng.multinomial(chunk_trials, np.full(len(chunk), 1 / len(chunk)))
+            weighted_sums += weights @ chunk
+            weights_sums += weights.sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            return weighted_sums / weights_sums
+
+    def _generate_weighted_bootstrap_metrics(self, data_one, data_two, design):
+        """Генерирует значения метрики бутстрепом с весами (bootstrap_engine 'poisson' или 'multinomial').
+
+        Параметры и результат как у _generate_bootstrap_metrics.
+        """
+        if design.bootstrap_agg_func != 'mean':
+            raise ValueError('Бутстреп с весами поддерживает только bootstrap_agg_func=\'mean\'')
+        bootstrap_metrics = (
+            self._get_weighted_bootstrap_means(data_two, design)
+            - self._get_weighted_bootstrap_means(data_one, design)
+        )
+        pe_metric = np.mean(data_two) - np.mean(data_one)
+        return bootstrap_metrics, pe_metric
+
     def _run_bootstrap(self, bootstrap_metrics, pe_metric, design):
         """Строит доверительный интервал и проверяет значимость отличий с помощью бутстрепа.
         
@@ -146,11 +568,120 @@ class ExperimentsService:
         ci = [left, right]
         return ci, pvalue
 
+    def get_pvalue_from_stats(self, stats_a, stats_b, design):
+        """Применяет t-test к группам, заданным достаточными статистиками, возвращает pvalue.
+
+        :param stats_a, stats_b (RunningStats): статистики значений метрик групп A и B.
+        :param design (Design): объект с данными, описывающий параметры эксперимента
+        :return (float): значение p-value
+        """
+        if design.statistical_test != 'ttest':
+            raise ValueError('По статистикам групп считается только design.statistical_test=\'ttest\'')
+        return float(self._get_ttest_pvalues(
+            stats_a.count, stats_a.mean, stats_a.m2, stats_b.count, stats_b.mean, stats_b.m2
+        ))
+
+    def _aggregate_stats(self, groups, by=()):
+        """Считает достаточные статистики групп одним проходом группировки.
+
+        Значения сдвигаются на общее среднее всех групп, это не меняет дисперсий, ковариаций
+        и разностей средних, но сохраняет точность сумм квадратов.
+
+        :param groups (list[pd.DataFrame]): датафреймы групп со столбцом 'metric'
+            и, если есть, 'covariate' и столбцами из by.
+        :param by (list[str]): столбцы, по которым группы дополнительно делятся (например, ['strata']).
+        :return (pd.DataFrame): index=(номер группы, *by), columns=['count', 'sum', 'sum_sq'] и, если есть
+            столбец 'covariate', ['covariate_sum', 'covariate_sum_sq', 'cross_sum'].
+        """
+        if not all(isinstance(group, pd.DataFrame) for group in groups):
+            raise ValueError('Для стратифицированного и CUPED t-test\'а группы должны быть датафреймами')
+        data = pd.concat(groups, keys=range(len(groups)), names=['group', None])
+        metric = data['metric'] - data['metric'].mean()
+        columns = {'count': np.ones(len(data), dtype=np.int64), 'sum': metric, 'sum_sq': metric ** 2}
+        if 'covariate' in data.columns:
+            covariate = data['covariate'] - data['covariate'].mean()
+            columns.update({
+                'covariate_sum': covariate, 'covariate_sum_sq': covariate ** 2, 'cross_sum': metric * covariate,
+            })
+        keys = [data.index.get_level_values('group'), *(data[column].values for column in by)]
+        return pd.DataFrame(columns).groupby(keys).sum()
+
+    def _get_strata_weights(self, strata_counts, design):
+        """Возвращает веса страт с ненулевым весом: design.strata_weights или доли страт в данных.
+
+        Если страты design.strata_weights не совпадают со стратами в данных (есть страта с ненулевым весом,
+        которой нет в данных, или страта в данных без веса), вызывается ValueError.
+        """
+        if design.strata_weights is None:
+            weights = strata_counts / strata_counts.sum()
+        else:
+            weights = pd.Series(design.strata_weights, dtype=float)
+            unknown_strata = weights.index[(weights > 0) & ~weights.index.isin(strata_counts.index)]
+            unweighted_strata = strata_counts.index[~strata_counts.index.isin(weights.index)]
+            if len(unknown_strata) or len(unweighted_strata):
+                raise ValueError(
+                    f'Страты design.strata_weights {list(weights.index)} не совпадают со стратами в данных '
+                    f'{list(strata_counts.index)}: нет в данных {list(unknown_strata)}, нет веса {list(unweighted_strata)}'
+                )
+            weights = weights / weights.sum()
+        return weights[weights > 0]
+
+    def _get_stratified_ttest_pvalue(self, metrics_a_group, metrics_b_group, design):
+        """Стратифицированный t-test по агрегатам страт.
+
+        Среднее группы - sum(w_k * mean_k), дисперсия среднего - sum(w_k ** 2 * var_k / n_k).
+        Каждая страта с ненулевым весом должна быть в обеих группах хотя бы с двумя значениями,
+        иначе её среднее или дисперсия не определены и вызывается ValueError.
+        """
+        strata_stats = self._aggregate_stats([metrics_a_group, metrics_b_group], by=['strata'])
+        weights = self._get_strata_weights(strata_stats.groupby(level=1)['count'].sum(), design)
+        means, mean_variances = [], []
+        for group in (0, 1):
+            group_stats = strata_stats.xs(group, level=0).reindex(weights.index)
+            small_strata = group_stats.index[~(group_stats['count'] >= 2)]
+            if len(small_strata):
+                raise ValueError(
+                    f'В группе {"AB"[group]} меньше двух значений в стратах {list(small_strata)}'
+                )
+            strata_means = group_stats['sum'] / group_stats['count']
+            strata_variances = (group_stats['sum_sq'] - group_stats['count'] * strata_means ** 2) / (group_stats['count'] - 1)
+            means.append((weights * strata_means).sum())
+            mean_variances.append((weights ** 2 * strata_variances / group_stats['count']).sum())
+        t = (means[1] - means[0]) / np.sqrt(mean_variances[0] + mean_variances[1])
+        return 2 * stats.norm.sf(np.abs(t))
+
+    def _get_cuped_ttest_pvalue(self, metrics_a_group, metrics_b_group, design):
+        """CUPED t-test по агрегатам групп.
+
+        Метрика заменяется на metric - theta * (covariate - mean(covariate)), theta = cov(metric, covariate) / var(covariate)
+        по объединению групп. Среднее и дисперсия новой метрики в группах выражаются через суммы,
+        после чего применяется t-test с равными дисперсиями.
+        """
+        group_stats = self._aggregate_stats([metrics_a_group, metrics_b_group])
+        total = group_stats.sum()
+        theta = (total['cross_sum'] - total['sum'] * total['covariate_sum'] / total['count']) \
+            / (total['covariate_sum_sq'] - total['covariate_sum'] ** 2 / total['count'])
+        count = group_stats['count']
+        mean = group_stats['sum'] / count
+        covariate_mean = group_stats['covariate_sum'] / count
+        cuped_mean = mean - theta * (covariate_mean - total['covariate_sum'] / total['count'])
+        m2 = group_stats['sum_sq'] - count * mean ** 2
+        covariate_m2 = group_stats['covariate_sum_sq'] - count * covariate_mean ** 2
+        cross_m2 = group_stats['cross_sum'] - count * mean * covariate_mean
+        cuped_m2 = m2 - 2 * theta * cross_m2 + theta ** 2 * covariate_m2
+        return float(self._get_ttest_pvalues(
+            count[0], cuped_mean[0], cuped_m2[0], count[1], cuped_mean[1], cuped_m2[1]
+        ))
+
+    @instrument('experiments.get_pvalue')
     def get_pvalue(self, metrics_a_group, metrics_b_group, design):
         """Применяет статтест, возвращает pvalue.
 
-        :param metrics_a_group (np.array): массив значений метрик группы A
-        :param metrics_a_group (np.array): массив значений метрик группы B
+        Для 'stratified ttest' и 'cuped ttest' группы передаются датафреймами со столбцами
+        ['metric', 'strata'] и ['metric', 'covariate'] соответственно.
+
+        :param metrics_a_group (np.array, pd.DataFrame): массив значений метрик группы A
+        :param metrics_a_group (np.array, pd.DataFrame): массив значений метрик группы B
         :param design (Design): объект с данными, описывающий параметры эксперимента
         :return (float): значение p-value
         """
@@ -161,5 +692,39 @@ class ExperimentsService:
             bootstrap_metrics, pe_metric = self._generate_bootstrap_metrics(metrics_a_group, metrics_b_group, design)
             _, pvalue = self._run_bootstrap(bootstrap_metrics, pe_metric, design)
             return pvalue
+        elif design.statistical_test == 'stratified ttest':
+            return self._get_stratified_ttest_pvalue(metrics_a_group, metrics_b_group, design)
+        elif design.statistical_test == 'cuped ttest':
+            return self._get_cuped_ttest_pvalue(metrics_a_group, metrics_b_group, design)
         else:
-            raise ValueError('Неверный design.statistical_test')
\ No newline at end of file
+            raise ValueError('Неверный design.statistical_test')
+
+
+# Данные метрик в процессах estimate_errors_grid, передаются один раз при создании процесса.
+_grid_worker_data = {}
+
+
+def _init_grid_worker(offsets, values):
+    _grid_worker_data['offsets'] = offsets
+    _grid_worker_data['values'] = values
+
+
+def _estimate_grid_block_in_worker(task):
+    return _estimate_grid_block(_grid_worker_data['offsets'], _grid_worker_data['values'], *task)
+
+
+def _estimate_grid_block(offsets, values, sample_size, designs, effect_add_type, n_iter, seed):
+    """Считает количество ошибок I и II рода на одном блоке итераций для дизайнов с одним размером групп.
+
+    :return (list[np.array]): для каждого дизайна [количество ошибок I рода, количество ошибок II рода].
+    """
+    service = ExperimentsService(seed)
+    groups = list(service._iterate_groups(service._sample_group_batches(offsets, values, sample_size, n_iter)))
+    block_errors = []
+    for design in designs:
+        pvalues_aa, pvalues_ab, _, _ = service._estimate_errors(iter(groups), design, effect_add_type)
+        block_errors.append(np.array([
+            np.sum(np.asarray(pvalues_aa) <= design.alpha),
+            np.sum(np.asarray(pvalues_ab) >= design.alpha),
+        ]))
+    return block_errors
@@ -0,0 +1,272 @@
+import functools
+import json
+import random
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+
+# Флаги проверяются в обёртке каждого вызова, поэтому это глобальные переменные модуля,
+# а не атрибуты объекта: в выключенном режиме обёртка стоит одну проверку и вызов функции.
+_enabled = False
+_trace_memory = False
+_started_tracemalloc = False
+
+_lock = threading.Lock()
+_local = threading.local()
+# Название операции -> {'wall_time': _Summary, 'allocated_bytes': _Summary, 'counters': {название счётчика: _Summary}}
+_records = {}
+# Генератор для выборок _Summary, используется под _lock
+_random = random.Random(0)
+
+PERCENTILES = (50, 90, 99)
+# Максимальный размер выборки значений, по которой считаются перцентили одной величины
+RESERVOIR_SIZE = 1024
+
+
+def enable(trace_memory=False):
+    """Включает сбор измерений.
+
+    :param trace_memory (bool): замерять пиковый объём памяти, выделенной за вызов, через tracemalloc.
+        Заметно замедляет numpy и pandas, поэтому включается отдельно.
+    """
+    global _enabled, _trace_memory, _started_tracemalloc
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _trace_memory = trace_memory
+    _enabled = True
+
+
+def disable():
+    """Выключает сбор измерений, собранные измерения сохраняются."""
+    global _enabled, _trace_memory, _started_tracemalloc
+    _enabled = False
+    _trace_memory = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Удаляет собранные измерения."""
+    with _lock:
+        _records.clear()
+
+
+class profile:
+
+    def __init__(self, trace_memory=False):
+        """Контекстный менеджер, включающий сбор измерений внутри блока with.
+
+        Пример:
+            with Instrumentation.profile():
+                metrics_service.calculate_metric('revenue (web)', begin_date, end_date)
+            print(Instrumentation.export_prometheus())
+        """
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        enable(self.trace_memory)
+        return self
+
+    def __exit__(self, *exc_info):
+        disable()
+
+
+def _get_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def add_counters(**counters):
+    """Добавляет значения счётчиков к текущему измеряемому вызову этого потока.
+
+    Стандартные счётчики: rows_scanned - сколько строк просмотрено, rows_returned - сколько строк
+    в результате, iterations - количество итераций симуляции или бутстрепа.
+    Если сбор измерений выключен или измеряемого вызова нет, ничего не делает.
+    """
+    if not _enabled:
+        return
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    frame_counters = stack[-1]['counters']
+    for name, value in counters.items():
+        frame_counters[name] = frame_counters.get(name, 0) + value
+
+
+def instrument(name):
+    """Декоратор, замеряющий вызовы функции под названием операции name.
+
+    Для каждого вызова записываются время выполнения, счётчики, добавленные через add_counters,
+    и, если включено, пиковый объём памяти, выделенной за вызов. Время вложенных измеряемых вызовов
+    входит во время внешнего вызова.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            return _call(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def _call(name, func, args, kwargs):
+    stack = _get_stack()
+    frame = {'counters': {}, 'memory_start': 0, 'memory_peak': 0}
+    trace_memory = _trace_memory and tracemalloc.is_tracing()
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # Пик внешнего вызова запоминается до сброса, чтобы вложенный вызов его не потерял
+            stack[-1]['memory_peak'] = max(stack[-1]['memory_peak'], peak)
+        tracemalloc.reset_peak()
+        frame['memory_start'] = frame['memory_peak'] = current
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        wall_time = time.perf_counter() - start
+        stack.pop()
+        allocated_bytes = None
+        if trace_memory and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame['memory_peak'])
+            allocated_bytes = peak - frame['memory_start']
+            if stack:
+                stack[-1]['memory_peak'] = max(stack[-1]['memory_peak'], peak)
+        _record(name, wall_time, allocated_bytes, frame['counters'])
+
+
+class _Summary:
+
+    def __init__(self, n_zeros=0):
+        """Сводка значений одной величины по вызовам операции в ограниченной памяти.
+
+        Количество, сумма и максимум считаются точно, перцентили - по равномерной выборке не больше
+        RESERVOIR_SIZE значений (reservoir sampling), поэтому память не растёт с количеством вызовов.
+        Пока значений не больше RESERVOIR_SIZE, перцентили точные.
+
+        :param n_zeros (int): количество нулевых значений, с которых начинается сводка.
+        """
+        self.count = n_zeros
+        self.sum = 0.
+        self.max = 0. if n_zeros else -np.inf
+        self.sample = [0.] * min(n_zeros, RESERVOIR_SIZE)
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        if len(self.sample) < RESERVOIR_SIZE:
+            self.sample.append(value)
+        else:
+            position = _random.randrange(self.count)
+            if position < RESERVOIR_SIZE:
+                self.sample[position] = value
+
+    def describe(self):
+        description = {'count': self.count, 'sum': float(self.sum), 'max': float(self.max)}
+        for q, value in zip(PERCENTILES, np.percentile(self.sample, PERCENTILES)):
+            description[f'p{q}'] = float(value)
+        return description
+
+
+def _record(name, wall_time, allocated_bytes, counters):
+    with _lock:
+        record = _records.setdefault(name, {'wall_time': _Summary(), 'allocated_bytes': _Summary(), 'counters': {}})
+        n_calls = record['wall_time'].count
+        record['wall_time'].add(wall_time)
+        if allocated_bytes is not None:
+            record['allocated_bytes'].add(allocated_bytes)
+        for counter_name in counters.keys() - record['counters'].keys():
+            # Счётчик впервые встретился не в первом вызове, в предыдущих вызовах он равен 0
+            record['counters'][counter_name] = _Summary(n_calls)
+        for counter_name, summary in record['counters'].items():
+            summary.add(counters.get(counter_name, 0))
+
+
+def get_summary():
+    """Возвращает агрегированные измерения.
+
+    :return (dict): название операции -> {
+            'calls': количество вызовов,
+            'wall_time': {'count', 'sum', 'max', 'p50', 'p90', 'p99'} в секундах,
+            'allocated_bytes': то же в байтах, только если память замерялась,
+            'counters': {название счётчика: то же по значениям за вызов},
+        }
+        count, sum и max точные, перцентили при количестве вызовов больше RESERVOIR_SIZE - оценка
+        по случайной выборке вызовов.
+    """
+    summary = {}
+    with _lock:
+        for name, record in sorted(_records.items()):
+            summary[name] = {'calls': record['wall_time'].count, 'wall_time': record['wall_time'].describe()}
+            if record['allocated_bytes'].count:
+                summary[name]['allocated_bytes'] = record['allocated_bytes'].describe()
+            summary[name]['counters'] = {
+                counter_name: counter_summary.describe()
+                for counter_name, counter_summary in sorted(record['counters'].items())
+            }
+    return summary
+
+
+def export_json(path=None):
+    """Возвращает агрегированные измерения в формате JSON, если задан path - ещё и записывает в файл."""
+    text = json.dumps(get_summary(), indent=2)
+    if path is not None:
+        with open(path, 'w') as file:
+            file.write(text)
+    return text
+
+
+def _format_summary(metric_name, operation, description):
+    lines = [
+        f'{metric_name}{{operation="{operation}",quantile="{q / 100}"}} {description[f"p{q}"]!r}'
+        for q in PERCENTILES
+    ]
+    lines.append(f'{metric_name}_sum{{operation="{operation}"}} {description["sum"]!r}')
+    lines.append(f'{metric_name}_count{{operation="{operation}"}} {description["count"]}')
+    return lines
+
+
+def export_prometheus(prefix='ab_platform'):
+    """Возвращает агрегированные измерения в текстовом формате Prometheus.
+
+    Время и память выгружаются как summary с квантилями, счётчики - как counter с суммой за все вызовы.
+    Операция передаётся меткой operation.
+    """
+    # Название метрики -> (тип, описание, строки со значениями всех операций)
+    families = {}
+
+    def add(metric_name, metric_type, help_text, lines):
+        families.setdefault(metric_name, (metric_type, help_text, []))[2].extend(lines)
+
+    for operation, summary in get_summary().items():
+        add(f'{prefix}_call_duration_seconds', 'summary', 'Время выполнения вызова.',
+            _format_summary(f'{prefix}_call_duration_seconds', operation, summary['wall_time']))
+        if 'allocated_bytes' in summary:
+            add(f'{prefix}_call_allocated_bytes', 'summary', 'Пиковая память, выделенная за вызов.',
+                _format_summary(f'{prefix}_call_allocated_bytes', operation, summary['allocated_bytes']))
+        for counter_name, description in summary['counters'].items():
+            metric_name = f'{prefix}_{counter_name}_total'
+            add(metric_name, 'counter', f'Сумма счётчика {counter_name} по вызовам.',
+                [f'{metric_name}{{operation="{operation}"}} {description["sum"]!r}'])
+
+    text = []
+    for metric_name, (metric_type, help_text, lines) in families.items():
+        text.append(f'# HELP {metric_name} {help_text}')
+        text.append(f'# TYPE {metric_name} {metric_type}')
+        text.extend(lines)
+    return '\n'.join(text) + '\n'
@@ -1,110 +1,549 @@
+import bisect
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
+from pydantic import BaseModel
+from typing import Optional
+
+from Instrumentation import add_counters, instrument
+from RunningStats import RunningStats
+from UserDictionary import has_user_filter
+
+
+class DailyAggregates:
+
+    def __init__(self, sum_columns):
+        """Предагрегированные по пользователям и дням данные одной таблицы.
+
+        Агрегаты хранятся отдельно по дням, поэтому добавление строк пересчитывает только дни,
+        в которые попали новые строки, и не копирует агрегаты остальных дней. Пустые агрегаты
+        заполняются через append частями таблицы, так что вся таблица в памяти не собирается.
+            days - отсортированный список дней,
+            day_2_daily - день -> датафрейм columns=['day', 'user_id', *sum_columns], user_id - коды:
+                одна строка на каждого пользователя, у которого в этот день были записи,
+                в sum_columns суммы значений за день,
+            first_date - np.array код пользователя -> дата первой записи пользователя, NaT - записей нет,
+                None, пока не добавлено ни одной строки,
+            version - версия таблицы, по которой построены агрегаты, выставляется MetricsService.
+
+        :param sum_columns (list[str]): столбцы, по которым нужно считать дневные суммы.
+        """
+        self.sum_columns = list(sum_columns)
+        self.version = None
+        self.days = []
+        self.day_2_daily = {}
+        self.first_date = None
+
+    def _aggregate(self, rows):
+        rows = rows.assign(day=rows['date'].dt.floor('D'))
+        return rows.groupby(['day', 'user_id'], as_index=False)[self.sum_columns].sum()
+
+    def append(self, rows):
+        """Инкрементально добавляет в агрегаты новые строки таблицы.
+
+        Пересчитываются только дни, в которые попали новые строки, и даты первой записи их пользователей.
+
+        :param rows (pd.DataFrame): строки таблицы, columns=['user_id', 'date', *sum_columns], user_id закодированы.
+        """
+        # Строки без пользователя не относятся ни к одному пользователю, как при groupby по user_id с NaN
+        rows = rows[rows['user_id'] >= 0]
+        if rows.empty:
+            return
+        new_daily = self._aggregate(rows)
+        day_bounds = np.flatnonzero(np.diff(new_daily['day'].values)) + 1
+        for lo, hi in zip(np.concatenate([[0], day_bounds]), np.concatenate([day_bounds, [len(new_daily)]])):
+            daily = new_daily.iloc[lo:hi]
+            day = daily['day'].iloc[0]
+            if day in self.day_2_daily:
+                daily = pd.concat([self.day_2_daily[day], daily], ignore_index=True) \
+                    .groupby(['day', 'user_id'], as_index=False)[self.sum_columns].sum()
+            else:
+                bisect.insort(self.days, day)
+            self.day_2_daily[day] = daily.reset_index(drop=True)
+        self._update_first_date(rows)
+
+    def _update_first_date(self, rows):
+        new_first_date = rows.groupby('user_id')['date'].min()
+        if self.first_date is None:
+            self.first_date = np.empty(0, dtype=rows['date'].dtype)
+        codes = new_first_date.index.values
+        dates = new_first_date.values.astype(self.first_date.dtype)
+        if codes.max() >= len(self.first_date):
+            # Ёмкость удваивается, чтобы новые пользователи не копировали массив при каждом добавлении
+            first_date = np.full(max(codes.max() + 1, 2 * len(self.first_date)), np.datetime64('NaT'), self.first_date.dtype)
+            first_date[:len(self.first_date)] = self.first_date
+            self.first_date = first_date
+        current = self.first_date[codes]
+        self.first_date[codes] = np.where(np.isnat(current) | (dates < current), dates, current)
+
+    def get_days(self, begin_day, end_day, user_ids=None):
+        """Возвращает дневные агрегаты за дни из интервала [begin_day, end_day).
+
+        :param begin_day, end_day (None, pd.Timestamp): границы интервала, None - без ограничения.
+        :param user_ids (None, np.array): коды пользователей, по которым нужно отфильтровать агрегаты.
+        :return (pd.DataFrame): columns=['day', 'user_id', *sum_columns].
+        """
+        lo = 0 if begin_day is None else bisect.bisect_left(self.days, begin_day)
+        hi = len(self.days) if end_day is None else bisect.bisect_left(self.days, end_day)
+        parts = [self.day_2_daily[day] for day in self.days[lo:hi]]
+        if not parts:
+            return pd.DataFrame({
+                'day': pd.Series(dtype='datetime64[ns]'), 'user_id': pd.Series(dtype=np.int32),
+                **{column: pd.Series(dtype=float) for column in self.sum_columns},
+            })
+        daily = pd.concat(parts, ignore_index=True)
+        if has_user_filter(user_ids):
+            daily = daily[daily['user_id'].isin(user_ids)]
+        return daily
+
+    def get_users_until(self, end_date, user_ids=None):
+        """Возвращает коды пользователей, у которых есть записи не позже end_date.
+
+        :return (pd.Index): отсортированные коды пользователей.
+        """
+        if self.first_date is None:
+            return pd.Index([], dtype=np.int32)
+        is_user = ~np.isnat(self.first_date)
+        if end_date:
+            is_user &= self.first_date <= pd.Timestamp(end_date).to_datetime64()
+        users = pd.Index(np.flatnonzero(is_user).astype(np.int32))
+        if has_user_filter(user_ids):
+            users = users[users.isin(user_ids)]
+        return users
+
+
+def _apply_row_filter(rows, row_filter, user_dictionary):
+    """Оставляет строки, удовлетворяющие условию row_filter метрики.
+
+    Внутри сервисов user_id в строках - коды, а в условии - исходные user_id, поэтому,
+    если условие упоминает user_id, оно проверяется по раскодированному столбцу.
+
+    :param rows (pd.DataFrame): строки таблицы, user_id закодированы user_dictionary.
+    :param row_filter (None, str): условие в синтаксисе pd.DataFrame.query, None - оставить все строки.
+    :param user_dictionary (UserDictionary): словарь, которым закодированы user_id.
+    :return (pd.DataFrame): отфильтрованные строки, user_id закодированы.
+    """
+    if row_filter is None:
+        return rows
+    if 'user_id' not in row_filter or 'user_id' not in rows.columns:
+        return rows.query(row_filter)
+    decoded_rows = rows.assign(user_id=user_dictionary.decode(rows['user_id'].values))
+    return rows[decoded_rows.eval(row_filter).values]
+
+
+class MetricDefinition(BaseModel):
+    """Дата-класс с описанием метрики.
+
+    name - название метрики
+    table_name - таблица, из которой берутся значения метрики
+    value_column - столбец таблицы со значениями метрики
+    row_filter - условие на строки таблицы в синтаксисе pd.DataFrame.query, None - брать все строки.
+        user_id в условии - исходные user_id, а не коды UserDictionary.
+    aggregation - агрегация значений по пользователю. [None, 'sum']
+        None - каждая строка это отдельное измерение, 'sum' - одно значение на пользователя, сумма за период.
+    population_table_name - таблица, по которой определяются пользователи метрики, None - только пользователи
+        с записями в table_name. Пользователям без записей в table_name ставится значение fill_value.
+    population_period - период, за который пользователь должен иметь записи в population_table_name.
+        ['period', 'until_end']. 'period' - в периоде [begin_date, end_date], 'until_end' - не позже end_date.
+    fill_value - значение метрики для пользователей без записей в table_name
+    """
+    name: str
+    table_name: str
+    value_column: str
+    row_filter: Optional[str] = None
+    aggregation: Optional[str] = None
+    population_table_name: Optional[str] = None
+    population_period: str = 'period'
+    fill_value: float = 0
+
+    @property
+    def source(self):
+        return self.table_name, self.row_filter
+
+
+# Время обработки запроса сервером. Каждый запрос независим, поэтому группировать по user_id не нужно.
+# Выручка (web) - сумма покупок пользователя за период для заходивших на сайт в этот же период.
+#     Нужна для экспериментов на сайте, когда в эксперимент попадают только те, кто заходил на сайт.
+# Выручка (all) - сумма покупок пользователя за период для заходивших на сайт до end_date.
+#     Нужна, например, для экспериментов с рассылкой по email, когда в эксперимент попадают те,
+#     кто когда-либо оставил нам свои данные.
+DEFAULT_METRICS = [
+    MetricDefinition(name='response time', table_name='web-logs', value_column='load_time'),
+    MetricDefinition(
+        name='revenue (web)', table_name='sales', value_column='price', aggregation='sum',
+        population_table_name='web-logs', population_period='period',
+    ),
+    MetricDefinition(
+        name='revenue (all)', table_name='sales', value_column='price', aggregation='sum',
+        population_table_name='web-logs', population_period='until_end',
+    ),
+]
+
+
+class LiveMetric:
+
+    def __init__(self, metrics_service, definition, begin_date, group_2_user_ids):
+        """Метрика работающего эксперимента, которая обновляется по мере поступления данных.
+
+        Для каждой группы хранятся RunningStats значений метрики. Для метрик с агрегацией по пользователю
+        дополнительно хранятся текущие значения пользователей и признак, что пользователь уже входит
+        в популяцию метрики. Новая пачка строк обновляет статистики только затронутых пользователей,
+        поэтому pvalue по текущему состоянию считается за O(количества групп) (ExperimentsService.get_pvalue_from_stats).
+        Статистики совпадают с полным пересчётом calculate_metric(metric_name, begin_date, None, user_ids).
+
+        :param metrics_service (MetricsService): сервис метрик, по данным которого строится начальное состояние.
+        :param definition (MetricDefinition): описание метрики.
+        :param begin_date (datetime): дата начала эксперимента.
+        :param group_2_user_ids (dict[str, list[str]]): пользователи групп эксперимента.
+        """
+        self.definition = definition
+        self.begin_date = begin_date
+        self.user_dictionary = user_dictionary = metrics_service.data_service.user_dictionary
+        self.user_groups = pd.concat([
+            pd.Series(group, index=user_dictionary.encode(user_ids)) for group, user_ids in group_2_user_ids.items()
+        ])
+        self.group_2_stats = {group: RunningStats() for group in group_2_user_ids}
+        user_ids = self.user_groups.index.values
+
+        if definition.aggregation is None:
+            metrics = metrics_service._calculate_metrics([definition.name], begin_date, None, user_ids)[definition.name]
+            self._update_group_stats(metrics['user_id'].values, metrics['metric'].values, RunningStats.update)
+            return
+
+        sums = metrics_service._get_period_sums(definition.source, [definition.value_column], begin_date, None, user_ids)
+        self.user_values = pd.Series(0., index=self.user_groups.index)
+        self.user_values.loc[sums.index] = sums[definition.value_column].values
+        if definition.population_table_name is None:
+            population = sums.index
+        else:
+            population = metrics_service._get_population(definition, begin_date, None, user_ids)
+        self.is_counted = pd.Series(False, index=self.user_groups.index)
+        self._add_to_population(population)
+
+    def _update_group_stats(self, user_ids, values, method):
+        """Применяет к статистикам групп метод RunningStats.update или RunningStats.remove."""
+        groups = self.user_groups.loc[user_ids].values
+        for group, group_values in pd.Series(values).groupby(groups):
+            method(self.group_2_stats[group], group_values.values)
+
+    def _add_to_population(self, user_ids):
+        user_ids = pd.Index(user_ids)
+        user_ids = user_ids[~self.is_counted.loc[user_ids].values]
+        self.is_counted.loc[user_ids] = True
+        self._update_group_stats(user_ids, self.user_values.loc[user_ids].values, RunningStats.update)
+
+    def append(self, table_name, rows):
+        """Обновляет статистики по новым строкам таблицы.
+
+        :param table_name (str): название таблицы с данными.
+        :param rows (pd.DataFrame): новые строки таблицы, user_id закодированы.
+        """
+        definition = self.definition
+        rows = rows[rows['user_id'].isin(self.user_groups.index)]
+        period_rows = rows[rows['date'] >= self.begin_date]
+
+        if table_name == definition.table_name:
+            source_rows = _apply_row_filter(period_rows, definition.row_filter, self.user_dictionary)
+            if definition.aggregation is None:
+                self._update_group_stats(
+                    source_rows['user_id'].values, source_rows[definition.value_column].values, RunningStats.update
+                )
+                return
+            deltas = source_rows.groupby('user_id')[definition.value_column].sum()
+            counted = deltas.index[self.is_counted.loc[deltas.index].values]
+            self._update_group_stats(counted, self.user_values.loc[counted].values, RunningStats.remove)
+            self.user_values.loc[deltas.index] += deltas.values
+            self._update_group_stats(counted, self.user_values.loc[counted].values, RunningStats.update)
+            if definition.population_table_name is None:
+                self._add_to_population(deltas.index)
+
+        if definition.aggregation is not None and table_name == definition.population_table_name:
+            population_rows = period_rows if definition.population_period == 'period' else rows
+            self._add_to_population(population_rows['user_id'].unique())
+
 
 class MetricsService:
 
-    def __init__(self, data_service):
+    def __init__(self, data_service, cache_size=128, metric_definitions=None):
         """Класс для вычисления метрик.
 
+        Метрики описываются декларативно (MetricDefinition) и хранятся в реестре.
+        Внутри сервиса пользователи представлены кодами data_service.user_dictionary,
+        строковые user_id восстанавливаются только в результатах calculate_metrics.
+        Суммы по пользователям считаем по дневным агрегатам (DailyAggregates), которые строятся
+        при первом обращении к таблице, а результаты вычисления таких метрик кешируем (LRU).
+        Агрегаты и кеш привязаны к версиям таблиц (DataService.get_table_version): после изменения
+        таблицы в обход append_data агрегаты строятся заново, а старые результаты из кеша не используются.
+
         :param data_service (DataService): объект класса, предоставляющий доступ к данным.
+        :param cache_size (int): максимальное количество результатов в кеше, 0 - не кешировать.
+        :param metric_definitions (None, list[MetricDefinition]): метрики реестра, None - DEFAULT_METRICS.
         """
         self.data_service = data_service
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._source_2_aggregates = {}
+        self.metric_name_2_definition = {}
+        self._live_metrics = []
+        for definition in metric_definitions or DEFAULT_METRICS:
+            self.register_metric(definition)
+
+    def register_metric(self, definition):
+        """Добавляет метрику в реестр.
+
+        :param definition (MetricDefinition): описание метрики.
+        """
+        if definition.aggregation not in (None, 'sum'):
+            raise ValueError('Неверное значение aggregation')
+        if definition.population_period not in ('period', 'until_end'):
+            raise ValueError('Неверное значение population_period')
+        self.metric_name_2_definition[definition.name] = definition
+        # Агрегаты строятся по столбцам метрик реестра, их нужно пересчитать с новым столбцом
+        aggregates = self._source_2_aggregates.get(definition.source)
+        if aggregates is not None and definition.value_column not in aggregates.sum_columns:
+            del self._source_2_aggregates[definition.source]
+        self._cache.clear()
 
     def _get_data_subset(self, table_name, begin_date, end_date, user_ids=None, columns=None):
         """Возвращает часть таблицы с данными."""
-        return self.data_service.get_data_subset(table_name, begin_date, end_date, user_ids, columns)
+        return self.data_service.get_data_subset(table_name, begin_date, end_date, user_ids, columns, encoded=True)
 
-    def _calculate_response_time(self, begin_date, end_date, user_ids):
-        """Вычисляет значения времени обработки запроса сервером.
-        
-        Нужно вернуть значения user_id и load_time из таблицы 'web-logs', отфильтрованные по date и user_id.
-        Считаем, что каждый запрос независим, поэтому группировать по user_id не нужно.
+    def _get_source_rows(self, source, begin_date, end_date, user_ids, columns):
+        """Возвращает часть таблицы с данными, отфильтрованную по условию row_filter источника."""
+        table_name, row_filter = source
+        if row_filter is None:
+            return self._get_data_subset(table_name, begin_date, end_date, user_ids, columns)
+        rows = self._get_data_subset(table_name, begin_date, end_date, user_ids)
+        return _apply_row_filter(rows, row_filter, self.data_service.user_dictionary)[columns]
 
-        :param begin_date, end_date (datetime): период времени, за который нужно считать значения.
-        :param user_id (None, list[str]): id пользователей, по которым нужно отфильтровать полученные значения.
-        
-        :return (pd.DataFrame): датафрейм с двумя столбцами ['user_id', 'metric']
+    def _get_sum_columns(self, source):
+        """Возвращает столбцы источника, которые суммируются метриками реестра."""
+        return sorted({
+            definition.value_column
+            for definition in self.metric_name_2_definition.values()
+            if definition.aggregation == 'sum' and definition.source == source
+        })
+
+    def _get_aggregates(self, source):
+        """Возвращает дневные агрегаты источника.
+
+        Агрегаты строятся по всей таблице при первом обращении и заново, если таблица изменилась
+        не через append_data (версия таблицы не совпадает с версией, по которой построены агрегаты).
+        Таблица читается по частям (DataService.iter_data_chunks), поэтому память при построении
+        зависит от размера части и агрегатов, а не от размера таблицы.
         """
-        df = self._get_data_subset(table_name='web-logs', begin_date=begin_date, end_date=end_date, user_ids=user_ids) \
-                    .rename(columns={'load_time': 'metric'})
-        return df[['user_id', 'metric']]
-
-    def _calculate_revenue_web(self, begin_date, end_date, user_ids):
-        """Вычисляет значения выручки с пользователя за указанный период
-        для заходивших на сайт в указанный период.
-
-        Эти данные нужны для экспериментов на сайте, когда в эксперимент попадают только те, кто заходил на сайт.
-        
-        Нужно вернуть значения user_id и выручки (sum(price)).
-        Данные о ценах в таблице 'sales'. Данные о заходивших на сайт в таблице 'web-logs'.
-        Если пользователь зашёл на сайт и ничего не купил, его суммарная стоимость покупок равна нулю.
-        Для каждого user_id должно быть ровно одно значение.
-
-        :param begin_date, end_date (datetime): период времени, за который нужно считать значения.
-            Также за этот период времени нужно выбирать пользователей, которые заходили на сайт.
-        :param user_id (None, list[str]): id пользователей, по которым нужно отфильтровать полученные значения.
-        
-        :return (pd.DataFrame): датафрейм с двумя столбцами ['user_id', 'metric']
+        table_name, row_filter = source
+        version = self.data_service.get_table_version(table_name)
+        aggregates = self._source_2_aggregates.get(source)
+        if aggregates is None or aggregates.version != version:
+            sum_columns = self._get_sum_columns(source)
+            columns = ['user_id', 'date', *sum_columns]
+            aggregates = DailyAggregates(sum_columns)
+            chunks = self.data_service.iter_data_chunks(table_name, columns if row_filter is None else None, encoded=True)
+            for rows in chunks:
+                aggregates.append(_apply_row_filter(rows, row_filter, self.data_service.user_dictionary)[columns])
+            aggregates.version = version
+            self._source_2_aggregates[source] = aggregates
+        return aggregates
+
+    def append_data(self, table_name, rows):
+        """Дописывает новые строки в таблицу и инкрементально обновляет агрегаты.
+
+        :param table_name (str): название таблицы с данными.
+        :param rows (pd.DataFrame): новые строки таблицы.
+        """
+        rows = rows.assign(user_id=self.data_service.user_dictionary.encode(rows['user_id']))
+        old_version = self.data_service.get_table_version(table_name)
+        self.data_service.append_rows(table_name, rows, encoded=True)
+        version = self.data_service.get_table_version(table_name)
+        for (source_table_name, row_filter), aggregates in self._source_2_aggregates.items():
+            # Устаревшие агрегаты не дополняем, они будут построены заново при обращении
+            if source_table_name != table_name or aggregates.version != old_version:
+                continue
+            source_rows = _apply_row_filter(rows, row_filter, self.data_service.user_dictionary)
+            aggregates.append(source_rows[['user_id', 'date', *aggregates.sum_columns]])
+            aggregates.version = version
+        self._cache.clear()
+        for live_metric in self._live_metrics:
+            live_metric.append(table_name, rows)
+
+    def create_live_metric(self, metric_name, begin_date, group_2_user_ids):
+        """Создаёт метрику работающего эксперимента, которая обновляется при вызовах append_data.
+
+        :param metric_name (str): название метрики из реестра.
+        :param begin_date (datetime): дата начала эксперимента.
+        :param group_2_user_ids (dict[str, list[str]]): пользователи групп эксперимента.
+        :return (LiveMetric): метрика, статистики групп в LiveMetric.group_2_stats.
+        """
+        live_metric = LiveMetric(self, self._get_definition(metric_name), begin_date, group_2_user_ids)
+        self._live_metrics.append(live_metric)
+        return live_metric
+
+    def _split_period(self, begin_date, end_date):
+        """Делит период [begin_date, end_date] на полные дни и края.
+
+        :return begin_day, end_day, edges:
+            begin_day, end_day (None, pd.Timestamp) - полные дни периода это [begin_day, end_day),
+            edges (list[(datetime, datetime, pd.Timestamp)]) - края периода, которые считаем по сырым данным:
+                (begin, end, exclude_from) - строки с begin <= date <= end и date < exclude_from.
+            Если полных дней в периоде нет, то begin_day и end_day равны None, а весь период - один край.
+            Границы краёв - pd.Timestamp, даже если begin_date и end_date заданы строками.
+        """
+        begin_date = pd.Timestamp(begin_date) if begin_date else None
+        end_date = pd.Timestamp(end_date) if end_date else None
+        begin_day = begin_date.ceil('D') if begin_date else None
+        end_day = end_date.floor('D') if end_date else None
+        if begin_day is not None and end_day is not None and begin_day >= end_day:
+            return None, None, [(begin_date, end_date, None)]
+        edges = []
+        if begin_date and begin_day > begin_date:
+            edges.append((begin_date, begin_day, begin_day))
+        if end_date:
+            edges.append((end_day, end_date, None))
+        return begin_day, end_day, edges
+
+    def _get_period_parts(self, source, columns, begin_date, end_date, user_ids):
+        """Возвращает части данных за период: сырые строки краёв периода и дневные агрегаты полных дней."""
+        begin_day, end_day, edges = self._split_period(begin_date, end_date)
+        parts = []
+        for edge_begin_date, edge_end_date, exclude_from in edges:
+            rows = self._get_source_rows(source, edge_begin_date, edge_end_date, user_ids, ['date', *columns])
+            if exclude_from is not None:
+                rows = rows[rows['date'] < exclude_from]
+            if 'user_id' in columns:
+                rows = rows[rows['user_id'] >= 0]
+            parts.append(rows[columns])
+        if begin_day is not None or end_day is not None or not edges:
+            parts.append(self._get_aggregates(source).get_days(begin_day, end_day, user_ids)[columns])
+        return parts
+
+    def _get_period_sums(self, source, columns, begin_date, end_date, user_ids=None):
+        """Возвращает суммы значений столбцов по пользователям за период [begin_date, end_date].
+
+        Полные дни берутся из дневных агрегатов, неполные дни на краях периода - из сырых данных.
+
+        :return (pd.DataFrame): index=код пользователя, columns=columns
+        """
+        parts = self._get_period_parts(source, ['user_id', *columns], begin_date, end_date, user_ids)
+        return pd.concat(parts, ignore_index=True).groupby('user_id')[columns].sum()
+
+    def _get_period_users(self, source, begin_date, end_date, user_ids=None):
+        """Возвращает пользователей, у которых есть записи за период [begin_date, end_date].
+
+        :return (pd.Index): отсортированные коды пользователей.
         """
-        ids = self._get_data_subset(table_name='web-logs', begin_date=begin_date, end_date=end_date, user_ids=user_ids)['user_id']
-        df_sales = self._get_data_subset(table_name='sales', begin_date=begin_date, end_date=end_date, user_ids=user_ids)[['user_id', 'price']]
-        # Группируем по user_id и суммируем значения цен
-        df_revenue = df_sales.groupby('user_id', as_index=False)['price'].sum()
-        # Оставляем только те записи, которые есть в таблице web-logs
-        df_revenue = df_revenue[df_revenue['user_id'].isin(ids)]
-        # Переименовываем столбец
-        df_revenue = df_revenue.rename(columns={'price': 'metric'})
-        all_users = set(ids)
-        purchased_users = set(df_revenue['user_id'])
-        non_purchased_users = all_users - purchased_users
-
-        # Создаем датафрейм для пользователей, которые не совершили покупок и присваиваем им метрику 0
-        df_no_purchase = pd.DataFrame({'user_id': list(non_purchased_users), 'metric': 0})
-
-        # Объединяем два датафрейма
-        result_df = pd.concat([df_revenue, df_no_purchase], ignore_index=True)
-        return result_df
-
-
-    def _calculate_revenue_all(self, begin_date, end_date, user_ids):
-        """Вычисляет значения выручки с пользователя за указанный период
-        для заходивших на сайт до end_date.
-
-        Эти данные нужны, например, для экспериментов с рассылкой по email,
-        когда в эксперимент попадают те, кто когда-либо оставил нам свои данные.
-        
-        Нужно вернуть значения user_id и выручки (sum(price)).
-        Данные о ценах в таблице 'sales'. Данные о заходивших на сайт в таблице 'web-logs'.
-        Если пользователь ничего не купил за указанный период, его суммарная стоимость покупок равна нулю.
-        Для каждого user_id должно быть ровно одно значение.
-
-        :param begin_date, end_date (datetime): период времени, за который нужно считать значения.
-            Нужно выбирать пользователей, которые хотя бы раз заходили на сайт до end_date.
-        :param user_id (None, list[str]): id пользователей, по которым нужно отфильтровать полученные значения.
-        
+        parts = self._get_period_parts(source, ['user_id'], begin_date, end_date, user_ids)
+        return pd.Index(pd.concat(parts, ignore_index=True)['user_id'].unique()).sort_values()
+
+    def _get_users_until(self, source, end_date, user_ids=None):
+        """Возвращает пользователей, у которых есть записи не позже end_date.
+
+        :return (pd.Index): отсортированные коды пользователей.
+        """
+        return self._get_aggregates(source).get_users_until(end_date, user_ids)
+
+    def _get_population(self, definition, begin_date, end_date, user_ids):
+        source = (definition.population_table_name, None)
+        if definition.population_period == 'period':
+            return self._get_period_users(source, begin_date, end_date, user_ids)
+        return self._get_users_until(source, end_date, user_ids)
+
+    def _fill_population(self, values, population, fill_value=0):
+        """Оставляет значения пользователей из population, для остальных из population значение fill_value.
+
         :return (pd.DataFrame): датафрейм с двумя столбцами ['user_id', 'metric']
         """
-        ids = self._get_data_subset(table_name='web-logs', begin_date=None, end_date=end_date, user_ids=user_ids)['user_id']
-        df_sales = self._get_data_subset(table_name='sales', begin_date=begin_date, end_date=end_date, user_ids=user_ids)[['user_id', 'price']]
-        # Группируем по user_id и суммируем значения цен
-        df_revenue = df_sales.groupby('user_id', as_index=False)['price'].sum()
-        # Оставляем только те записи, которые есть в таблице web-logs
-        df_revenue = df_revenue[df_revenue['user_id'].isin(ids)]
-        # Переименовываем столбец
-        df_revenue = df_revenue.rename(columns={'price': 'metric'})
+        metric = values.reindex(population, fill_value=fill_value)
+        return pd.DataFrame({'user_id': population.values, 'metric': metric.values})
 
-        # Создаем список пользователей, которые заходили на сайт, но ничего не купили
-        all_users = set(ids)
-        purchased_users = set(df_revenue['user_id'])
-        non_purchased_users = all_users - purchased_users
+    def _get_definition(self, metric_name):
+        if metric_name not in self.metric_name_2_definition:
+            raise ValueError('Wrong metric name')
+        return self.metric_name_2_definition[metric_name]
 
-        # Создаем датафрейм для пользователей, которые не совершили покупок и присваиваем им метрику 0
-        df_no_purchase = pd.DataFrame({'user_id': list(non_purchased_users), 'metric': 0})
+    def calculate_metrics(self, metric_names, begin_date, end_date, user_ids=None):
+        """Считает значения для вычисления нескольких метрик за один проход по данным.
 
-        # Объединяем два датафрейма
-        result_df = pd.concat([df_revenue, df_no_purchase], ignore_index=True)
-        return result_df
-        
+        Метрики группируются по источнику (таблица и row_filter): для всех поэлементных метрик источника
+        таблица читается один раз, для всех суммируемых метрик источника выполняется одна группировка.
+        Пользователи без записей дополняются значением fill_value через reindex.
 
+        :param metric_names (list[str]): названия метрик из реестра.
+        :param begin_date (datetime): дата начала периода (включая границу)
+        :param end_date (datetime): дата окончания периода (не включая границу)
+        :param user_ids (list[str], None): список пользователей.
+            Если None, то вычисляет значения для всех пользователей.
+        :return (dict[str, pd.DataFrame]): название метрики -> df, columns=['user_id', 'metric']
+        """
+        user_dictionary = self.data_service.user_dictionary
+        if has_user_filter(user_ids):
+            user_ids = user_dictionary.lookup(user_ids)
+        metric_name_2_result = self._calculate_metrics(metric_names, begin_date, end_date, user_ids)
+        return {
+            metric_name: result.assign(user_id=user_dictionary.decode(result['user_id'].values))
+            for metric_name, result in metric_name_2_result.items()
+        }
+
+    def _get_cache_key(self, definition, begin_date, end_date, user_key):
+        """Ключ кеша результата метрики, включает версии таблиц, по которым она считается."""
+        versions = tuple(
+            self.data_service.get_table_version(table_name)
+            for table_name in (definition.table_name, definition.population_table_name)
+            if table_name is not None
+        )
+        return definition.name, begin_date, end_date, user_key, versions
+
+    def _calculate_metrics(self, metric_names, begin_date, end_date, user_ids=None):
+        """Считает значения метрик по кодам пользователей, параметры как у calculate_metrics.
+
+        :param user_ids (np.array, None): коды пользователей.
+        :return (dict[str, pd.DataFrame]): название метрики -> df, columns=['user_id', 'metric'], user_id - коды.
+        """
+        definitions = [self._get_definition(metric_name) for metric_name in metric_names]
+        user_key = frozenset(user_ids) if has_user_filter(user_ids) else None
+        metric_name_2_result = {}
+        source_2_row_definitions = {}
+        source_2_sum_definitions = {}
+        for definition in definitions:
+            key = self._get_cache_key(definition, begin_date, end_date, user_key)
+            if definition.aggregation is None:
+                source_2_row_definitions.setdefault(definition.source, []).append(definition)
+            elif key in self._cache:
+                self._cache.move_to_end(key)
+                metric_name_2_result[definition.name] = self._cache[key].copy()
+            else:
+                source_2_sum_definitions.setdefault(definition.source, []).append(definition)
+
+        for source, source_definitions in source_2_row_definitions.items():
+            columns = list(dict.fromkeys(definition.value_column for definition in source_definitions))
+            rows = self._get_source_rows(source, begin_date, end_date, user_ids, ['user_id', *columns])
+            for definition in source_definitions:
+                metric_name_2_result[definition.name] = rows[['user_id', definition.value_column]] \
+                    .rename(columns={definition.value_column: 'metric'})
+
+        populations = {}
+        for source, source_definitions in source_2_sum_definitions.items():
+            columns = list(dict.fromkeys(definition.value_column for definition in source_definitions))
+            sums = self._get_period_sums(source, columns, begin_date, end_date, user_ids)
+            for definition in source_definitions:
+                values = sums[definition.value_column]
+                if definition.population_table_name is None:
+                    result = pd.DataFrame({'user_id': values.index.values, 'metric': values.values})
+                else:
+                    population_key = (definition.population_table_name, definition.population_period)
+                    if population_key not in populations:
+                        populations[population_key] = self._get_population(definition, begin_date, end_date, user_ids)
+                    result = self._fill_population(values, populations[population_key], definition.fill_value)
+                metric_name_2_result[definition.name] = result
+                if self.cache_size > 0:
+                    self._cache[self._get_cache_key(definition, begin_date, end_date, user_key)] = result.copy()
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+
+        return {metric_name: metric_name_2_result[metric_name] for metric_name in metric_names}
+
+    @instrument('metrics.calculate_metric')
     def calculate_metric(self, metric_name, begin_date, end_date, user_ids=None):
         """Считает значения для вычисления метрик.
 
@@ -115,15 +554,11 @@ class MetricsService:
             Если None, то вычисляет значения для всех пользователей.
         :return df: columns=['user_id', 'metric']
         """
-        if metric_name == 'response time':
-            return self._calculate_response_time(begin_date, end_date, user_ids)
-        elif metric_name == 'revenue (web)':
-            return self._calculate_revenue_web(begin_date, end_date, user_ids)
-        elif metric_name == 'revenue (all)':
-            return self._calculate_revenue_all(begin_date, end_date, user_ids)
-        else:
-            raise ValueError('Wrong metric name')
-        
+        metric = self.calculate_metrics([metric_name], begin_date, end_date, user_ids)[metric_name]
+        add_counters(rows_returned=len(metric))
+        return metric
+
+    @instrument('metrics.process_outliers')
     def process_outliers(self, metrics, design):
         """Возвращает новый датафрейм с обработанными выбросами в измерениях метрики.
 
@@ -132,6 +567,7 @@ class MetricsService:
         :return df: columns=['user_id', 'metric']
         """
         # YOUR_CODE_HERE
+        add_counters(rows_scanned=len(metrics))
 
         if design.metric_outlier_process_type == 'drop':
             metrics = metrics[(metrics['metric'] >= design.metric_outlier_lower_bound) &
@@ -140,4 +576,5 @@ class MetricsService:
         if design.metric_outlier_process_type == 'clip':
             metrics['metric'].clip(lower=design.metric_outlier_lower_bound, upper=design.metric_outlier_upper_bound, inplace=True)
 
+        add_counters(rows_returned=len(metrics))
         return metrics
\ No newline at end of file
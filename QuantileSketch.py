@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class QuantileSketch:
+
+    # Количество блоков из 2k значений, которые update сжимает за одну векторную операцию
+    chunk_blocks = 16
+
+    def __init__(self, k=1024, random_state=None):
+        """Сжатое представление выборки для приближённого вычисления квантилей (компакторы KLL).
+
+        Значения хранятся по уровням, значение уровня h имеет вес 2 ** h. Когда на уровне становится
+        больше k значений, они сортируются, каждое второе (со случайным сдвигом) переносится на уровень
+        выше с удвоенным весом, остальные удаляются. Сумма весов всегда равна количеству значений n.
+
+        Оценка ошибки: одно сжатие уровня h меняет ранг любого значения не больше чем на 2 ** h,
+        поэтому абсолютная ошибка ранга не больше суммы 2 ** h по всем сжатиям (rank_error),
+        это не больше n * log2(n / k) / k. Случайный сдвиг делает ошибки несмещёнными, и на практике
+        ошибка порядка n * sqrt(log2(n / k)) / k. Память - O(k * (log2(n / k) + chunk_blocks)) значений,
+        то есть скетч нужен, когда нельзя держать в памяти отсортированную копию выборки:
+        по времени он не быстрее np.sort.
+        Скетчи одинакового k можно объединять (merge), оценка ошибки при этом складывается.
+
+        :param k (int): максимальное количество значений на уровне, чем больше, тем точнее.
+        :param random_state (None, int, np.random.Generator): состояние генератора случайных сдвигов.
+        """
+        self.k = k
+        self.rng = np.random.default_rng(random_state)
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.error_mass = 0
+
+    def update(self, values):
+        """Добавляет значения в скетч.
+
+        Значения обрабатываются кусками по chunk_blocks блоков из 2k значений: блоки сортируются
+        и сжимаются на уровень 1 одной векторной операцией (каждый блок - отдельное сжатие уровня 0),
+        поэтому память не зависит от количества значений и полная сортировка не нужна.
+
+        :param values (np.array): значения.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        block_size = 2 * self.k
+        chunk_size = block_size * self.chunk_blocks
+        for start in range(0, len(values), chunk_size):
+            chunk = np.concatenate([self.levels[0], values[start:start + chunk_size]])
+            n_blocks = len(chunk) // block_size
+            if n_blocks:
+                blocks = np.sort(chunk[:n_blocks * block_size].reshape(n_blocks, block_size), axis=1)
+                offsets = self.rng.integers(2, size=(n_blocks, 1))
+                promoted = np.take_along_axis(blocks, offsets + 2 * np.arange(self.k), axis=1)
+                if len(self.levels) == 1:
+                    self.levels.append(np.empty(0))
+                self.levels[1] = np.concatenate([self.levels[1], promoted.ravel()])
+                self.error_mass += n_blocks
+            self.levels[0] = chunk[n_blocks * block_size:]
+            self._compact()
+        self.n += len(values)
+        return self
+
+    def merge(self, other):
+        """Добавляет в скетч значения другого скетча.
+
+        :param other (QuantileSketch): скетч с тем же k.
+        """
+        if other.k != self.k:
+            raise ValueError('Объединять можно только скетчи с одинаковым k')
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.n += other.n
+        self.error_mass += other.error_mass
+        self._compact()
+        return self
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self.k:
+                values = np.sort(values)
+                n_promoted = len(values) // 2 * 2
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                offset = self.rng.integers(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], values[offset:n_promoted:2]])
+                self.levels[level] = values[n_promoted:]
+                self.error_mass += 2 ** level
+            level += 1
+
+    @property
+    def rank_error(self):
+        """Гарантированная верхняя граница ошибки ранга, делённая на n."""
+        return self.error_mass / self.n if self.n else 0.
+
+    def _get_sorted_items(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2 ** level) for level, level_values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    def get_values_at_ranks(self, ranks):
+        """Возвращает приближённые значения порядковых статистик.
+
+        :param ranks (np.array): ранги от 0 до n - 1, ранг 0 - минимальное значение.
+        :return (np.array): значения с указанными рангами.
+        """
+        values, cumulative_weights = self._get_sorted_items()
+        positions = np.searchsorted(cumulative_weights, ranks, side='right')
+        return values[np.minimum(positions, len(values) - 1)]
+
+    def quantile(self, q):
+        """Возвращает приближённый квантиль с линейной интерполяцией, как np.quantile.
+
+        :param q (float): уровень квантиля от 0 до 1.
+        """
+        position = (self.n - 1) * q
+        lower = int(np.floor(position))
+        upper = min(lower + 1, self.n - 1)
+        low_value, high_value = self.get_values_at_ranks(np.array([lower, upper]))
+        return low_value + (position - lower) * (high_value - low_value)
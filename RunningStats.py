@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class RunningStats:
+
+    def __init__(self, count=0, mean=0., m2=0.):
+        """Достаточные статистики выборки, которые можно обновлять по мере поступления данных.
+
+        Хранятся количество значений, среднее и сумма квадратов отклонений от среднего (как в алгоритме
+        Уэлфорда). Пачки значений добавляются и удаляются формулами Чана для объединения выборок,
+        поэтому статистики не теряют точность из-за вычитания больших сумм квадратов.
+
+        :param count (int): количество значений.
+        :param mean (float): среднее значение.
+        :param m2 (float): сумма квадратов отклонений от среднего.
+        """
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_values(cls, values):
+        """Вычисляет статистики по массиву значений."""
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return cls()
+        mean = values.mean()
+        return cls(len(values), mean, ((values - mean) ** 2).sum())
+
+    @property
+    def variance(self):
+        """Несмещённая оценка дисперсии."""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    def merge(self, other):
+        """Добавляет к выборке другую выборку, заданную статистиками."""
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.mean = self.mean + delta * other.count / count
+        self.count = count
+        return self
+
+    def subtract(self, other):
+        """Удаляет из выборки её часть, заданную статистиками."""
+        count = self.count - other.count
+        if other.count == 0:
+            return self
+        if count <= 0:
+            self.count, self.mean, self.m2 = 0, 0., 0.
+            return self
+        mean = (self.count * self.mean - other.count * other.mean) / count
+        delta = other.mean - mean
+        self.m2 = max(0., self.m2 - other.m2 - delta ** 2 * count * other.count / self.count)
+        self.mean = mean
+        self.count = count
+        return self
+
+    def update(self, values):
+        """Добавляет значения в выборку."""
+        return self.merge(RunningStats.from_values(values))
+
+    def remove(self, values):
+        """Удаляет значения из выборки."""
+        return self.subtract(RunningStats.from_values(values))
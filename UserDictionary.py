@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+# Код строк с пустым user_id (None, NaN). Не совпадает с кодом -1 неизвестных пользователей из lookup,
+# поэтому строки без пользователя никогда не попадают в фильтр по пользователям.
+MISSING_CODE = -2
+
+
+def has_user_filter(user_ids):
+    """Проверяет, задан ли фильтр по пользователям: None и пустой список означают, что фильтровать не нужно."""
+    return user_ids is not None and len(user_ids) > 0
+
+
+class UserDictionary:
+
+    def __init__(self):
+        """Общий словарь user_id, кодирующий их плотными целыми числами int32.
+
+        Внутри сервисов пользователи хранятся, фильтруются, группируются и сэмплируются по кодам,
+        строковые user_id восстанавливаются только на границе публичного API.
+        Код пользователя не меняется после добавления в словарь. Пустые user_id не добавляются
+        в словарь, им соответствует код MISSING_CODE.
+
+        Хранятся dict user_id -> код и массив user_id по кодам с запасом ёмкости (удваивается при
+        заполнении), поэтому время encode и lookup зависит от размера пачки, а не словаря.
+        Для decode массив user_id переводится в массив pandas (для строк - строковый dtype), это делается
+        при первом decode после добавления пользователей, чтобы результат не конвертировался при каждом вызове.
+        """
+        self.user_id_2_code = {}
+        self.user_ids = np.empty(0, dtype=object)
+        self.n_users = 0
+        self._decode_values = None
+
+    def __len__(self):
+        return self.n_users
+
+    def _get_codes(self, uniques):
+        get_code = self.user_id_2_code.get
+        return np.fromiter((get_code(user_id, -1) for user_id in uniques), dtype=np.int64, count=len(uniques))
+
+    def encode(self, user_ids):
+        """Возвращает коды user_id, новые user_id добавляются в словарь.
+
+        :param user_ids (list[str], np.array, pd.Series): user_id.
+        :return (np.array): коды, dtype=int32, для пустых user_id - MISSING_CODE.
+        """
+        local_codes, uniques = pd.factorize(np.asarray(user_ids, dtype=object))
+        codes = self._get_codes(uniques)
+        is_new = codes < 0
+        n_new = int(is_new.sum())
+        if n_new:
+            new_user_ids = uniques[is_new]
+            codes[is_new] = np.arange(self.n_users, self.n_users + n_new)
+            if self.n_users + n_new > len(self.user_ids):
+                user_ids = np.empty(max(2 * len(self.user_ids), self.n_users + n_new), dtype=object)
+                user_ids[:self.n_users] = self.user_ids[:self.n_users]
+                self.user_ids = user_ids
+            self.user_ids[self.n_users:self.n_users + n_new] = new_user_ids
+            self.user_id_2_code.update(zip(new_user_ids, range(self.n_users, self.n_users + n_new)))
+            self.n_users += n_new
+        codes = np.append(codes, MISSING_CODE).astype(np.int32)
+        # pd.factorize возвращает -1 для пустых значений, это последний элемент codes - MISSING_CODE
+        return codes[local_codes]
+
+    def lookup(self, user_ids):
+        """Возвращает коды user_id без изменения словаря, для неизвестных user_id код -1.
+
+        :param user_ids (list[str]): user_id.
+        :return (np.array): уникальные коды, dtype=int32.
+        """
+        return np.unique(self._get_codes(pd.unique(np.asarray(user_ids, dtype=object)))).astype(np.int32)
+
+    def decode(self, codes):
+        """Возвращает user_id по кодам.
+
+        :param codes (np.array): коды.
+        :return (np.array, pd.api.extensions.ExtensionArray): user_id, для кода MISSING_CODE - NaN.
+        """
+        if self._decode_values is None or len(self._decode_values) != self.n_users:
+            self._decode_values = pd.Index(self.user_ids[:self.n_users]).array
+        codes = np.asarray(codes)
+        if len(codes) and codes.min() < 0:
+            codes = np.where(codes >= 0, codes, -1)
+        return pd.api.extensions.take(self._decode_values, codes, allow_fill=True)
@@ -0,0 +1,5 @@
+"""Бенчмарки горячих путей платформы на синтетических данных.
+
+Запуск: python -m benchmarks --rows 1e5 --save baseline.json
+        python -m benchmarks --rows 1e5 --baseline baseline.json --max-regression 0.2
+"""
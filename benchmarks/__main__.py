@@ -0,0 +1,42 @@
+import argparse
+import sys
+
+from benchmarks.cases import BENCHMARKS, BenchmarkContext
+from benchmarks.runner import compare, format_table, load_results, run_benchmarks, save_results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарки горячих путей платформы.')
+    parser.add_argument('--rows', type=float, default=1e5, help='количество строк в web-logs, от 1e5 до 1e8')
+    parser.add_argument('--seed', type=int, default=0, help='начальное состояние генератора данных')
+    parser.add_argument('--repeat', type=int, default=5, help='количество запусков каждого бенчмарка')
+    parser.add_argument('--filter', default='', help='запускать только бенчмарки, в названии которых есть строка')
+    parser.add_argument('--baseline', help='json с сохранёнными результатами для сравнения')
+    parser.add_argument('--save', help='куда сохранить результаты (json)')
+    parser.add_argument('--max-regression', type=float, default=.2,
+                        help='допустимый относительный рост времени и памяти, при превышении код возврата 1')
+    args = parser.parse_args(argv)
+
+    benchmarks = {name: func for name, func in BENCHMARKS.items() if args.filter in name}
+    context = BenchmarkContext(int(args.rows), seed=args.seed)
+    results = run_benchmarks(benchmarks, context, repeat=args.repeat)
+
+    baseline = {}
+    if args.baseline:
+        baseline_data = load_results(args.baseline)
+        if baseline_data.get('rows') != int(args.rows):
+            print(f'Внимание: baseline посчитан для rows={baseline_data.get("rows")}', file=sys.stderr)
+        baseline = baseline_data['results']
+    rows, regressions = compare(results, baseline, args.max_regression)
+    print(format_table(rows))
+
+    if args.save:
+        save_results(results, args.save, rows=int(args.rows), seed=args.seed)
+    if regressions:
+        print(f'Регрессия больше {args.max_regression:.0%}: {", ".join(regressions)}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from DataService import DataService
+from ExperimentDesign import Design
+from ExperimentsService import ExperimentsService
+from MetricsService import MetricsService
+from benchmarks.synthetic import generate_tables
+
+
+class BenchmarkContext:
+
+    def __init__(self, n_rows, seed=0):
+        """Данные и сервисы, общие для всех бенчмарков одного размера.
+
+        Построение индексов DataService и дневных агрегатов MetricsService выполняется здесь,
+        а не в замеряемых вызовах. Кеш результатов метрик выключен, чтобы замерять вычисление.
+
+        :param n_rows (int): количество строк в 'web-logs'.
+        :param seed (int): начальное состояние генератора данных.
+        """
+        self.tables = generate_tables(n_rows, seed=seed)
+        self.data_service = DataService(self.tables)
+        self.metrics_service = MetricsService(self.data_service, cache_size=0)
+        self.experiments_service = ExperimentsService(random_state=seed)
+
+        dates = self.tables['web-logs']['date']
+        self.begin_date = dates.min() + pd.Timedelta(days=7, hours=6)
+        self.end_date = self.begin_date + pd.Timedelta(days=14)
+        all_user_ids = self.tables['web-logs']['user_id'].unique()
+        self.user_ids = list(np.random.default_rng(seed).choice(all_user_ids, min(1000, len(all_user_ids)), replace=False))
+
+        self.response_time = self.metrics_service.calculate_metric('response time', self.begin_date, self.end_date)
+        self.revenue = self.metrics_service.calculate_metric('revenue (web)', self.begin_date, self.end_date)
+        n_users = self.revenue['user_id'].nunique()
+        self.design = Design(
+            metric_name='revenue (web)',
+            metric_outlier_lower_bound=0,
+            metric_outlier_upper_bound=self.revenue['metric'].quantile(.99),
+            metric_outlier_process_type='clip',
+            sample_size=max(1, min(1000, n_users // 4)),
+        )
+        group_size = min(100_000, len(self.response_time) // 2)
+        self.bootstrap_groups = (
+            self.response_time['metric'].values[:group_size],
+            self.response_time['metric'].values[group_size:2 * group_size],
+        )
+
+
+def _get_subset(context):
+    return context.data_service.get_data_subset('web-logs', context.begin_date, context.end_date)
+
+
+def _get_subset_users(context):
+    return context.data_service.get_data_subset('web-logs', context.begin_date, context.end_date, context.user_ids)
+
+
+def _metric(metric_name):
+    def run(context):
+        return context.metrics_service.calculate_metric(metric_name, context.begin_date, context.end_date)
+    return run
+
+
+def _process_outliers(process_type):
+    def run(context):
+        design = context.design.model_copy(update={'metric_outlier_process_type': process_type})
+        return context.metrics_service.process_outliers(context.revenue.copy(), design)
+    return run
+
+
+def _estimate_sample_size(context):
+    return context.experiments_service.estimate_sample_size(context.revenue, context.design)
+
+
+def _group_generator(context):
+    n_iter = 0
+    for _ in context.experiments_service._create_group_generator(context.response_time, context.design.sample_size, 1000):
+        n_iter += 1
+    return n_iter
+
+
+def _estimate_errors(context):
+    return context.experiments_service.estimate_errors(context.revenue, context.design, 'all_percent', 1000)
+
+
+def _bootstrap(agg_func):
+    def run(context):
+        design = context.design.model_copy(update={'statistical_test': 'bootstrap', 'bootstrap_agg_func': agg_func})
+        return context.experiments_service.get_pvalue(*context.bootstrap_groups, design)
+    return run
+
+
+# Название бенчмарка -> функция от BenchmarkContext, время которой замеряется
+BENCHMARKS = {
+    'data_service.get_data_subset': _get_subset,
+    'data_service.get_data_subset[user_ids]': _get_subset_users,
+    'metrics.response_time': _metric('response time'),
+    'metrics.revenue_web': _metric('revenue (web)'),
+    'metrics.revenue_all': _metric('revenue (all)'),
+    'metrics.process_outliers[drop]': _process_outliers('drop'),
+    'metrics.process_outliers[clip]': _process_outliers('clip'),
+    'experiments.estimate_sample_size': _estimate_sample_size,
+    'experiments.group_generator': _group_generator,
+    'experiments.estimate_errors': _estimate_errors,
+    'experiments.bootstrap[mean]': _bootstrap('mean'),
+    'experiments.bootstrap[quantile 95]': _bootstrap('quantile 95'),
+}
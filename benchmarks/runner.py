@@ -0,0 +1,81 @@
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def measure(func, context, repeat=5):
+    """Замеряет время и пиковую память вызова func(context).
+
+    Время - минимум и медиана по repeat запускам. Пиковая память замеряется отдельным запуском
+    под tracemalloc (numpy и pandas сообщают ему о своих аллокациях), чтобы не искажать время.
+
+    :return (dict): {'time_min': ..., 'time_median': ..., 'peak_memory': ...}, время в секундах, память в байтах.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(context)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func(context)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'time_min': min(times), 'time_median': float(np.median(times)), 'peak_memory': peak_memory}
+
+
+def run_benchmarks(benchmarks, context, repeat=5):
+    """Запускает бенчмарки.
+
+    :param benchmarks (dict[str, callable]): название -> функция от контекста.
+    :return (dict[str, dict]): название -> результат measure.
+    """
+    return {name: measure(func, context, repeat) for name, func in benchmarks.items()}
+
+
+def compare(results, baseline, max_regression):
+    """Сравнивает результаты с сохранёнными.
+
+    Регрессией считается рост минимального времени или пиковой памяти больше чем в (1 + max_regression) раз.
+
+    :return rows (list[dict]), regressions (list[str]): строки таблицы сравнения и названия бенчмарков с регрессией.
+    """
+    rows, regressions = [], []
+    for name, result in results.items():
+        row = {'name': name, **result}
+        base = baseline.get(name)
+        if base is not None:
+            row['time_ratio'] = result['time_min'] / base['time_min'] if base['time_min'] else np.nan
+            row['memory_ratio'] = result['peak_memory'] / base['peak_memory'] if base['peak_memory'] else np.nan
+            if row['time_ratio'] > 1 + max_regression or row['memory_ratio'] > 1 + max_regression:
+                regressions.append(name)
+        rows.append(row)
+    return rows, regressions
+
+
+def format_table(rows):
+    """Форматирует таблицу сравнения для вывода в консоль."""
+    header = f'{"benchmark":<42} {"time, ms":>10} {"median, ms":>11} {"peak, MiB":>10} {"time x":>7} {"mem x":>7}'
+    lines = [header, '-' * len(header)]
+    for row in rows:
+        time_ratio = f'{row["time_ratio"]:.2f}' if 'time_ratio' in row else '-'
+        memory_ratio = f'{row["memory_ratio"]:.2f}' if 'memory_ratio' in row else '-'
+        lines.append(
+            f'{row["name"]:<42} {row["time_min"] * 1e3:>10.2f} {row["time_median"] * 1e3:>11.2f} '
+            f'{row["peak_memory"] / 2 ** 20:>10.2f} {time_ratio:>7} {memory_ratio:>7}'
+        )
+    return '\n'.join(lines)
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_results(results, path, **metadata):
+    with open(path, 'w') as file:
+        json.dump({**metadata, 'results': results}, file, indent=2)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+
+def generate_tables(n_rows, n_users=None, n_sales=None, n_days=30, activity_skew=1.,
+                    begin_date='2022-01-01', seed=0):
+    """Генерирует таблицы 'web-logs' и 'sales' с неравномерной активностью пользователей.
+
+    Активность пользователей распределена по закону Ципфа: пользователь с рангом r делает
+    запросы и покупки с вероятностью, пропорциональной r ** -activity_skew. Строки отсортированы
+    по дате, как при выгрузке логов.
+
+    :param n_rows (int): количество строк в 'web-logs'.
+    :param n_users (None, int): количество пользователей, None - n_rows // 20.
+    :param n_sales (None, int): количество строк в 'sales', None - n_rows // 10.
+    :param n_days (int): длина периода данных в днях.
+    :param activity_skew (float): показатель неравномерности активности пользователей.
+    :param begin_date (str): дата начала периода данных.
+    :param seed (int): начальное состояние генератора случайных чисел.
+    :return (dict[str, pd.DataFrame]): словарь таблиц для DataService.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = int(n_rows)
+    n_users = int(n_users or max(1, n_rows // 20))
+    n_sales = int(n_sales or max(1, n_rows // 10))
+    user_ids = np.array([f'user_{i}' for i in range(n_users)], dtype=object)
+    activity = rng.permutation(np.arange(1, n_users + 1) ** -float(activity_skew))
+    activity /= activity.sum()
+
+    def generate_dates(n):
+        seconds = np.sort(rng.integers(0, n_days * 24 * 60 * 60, n))
+        return pd.Timestamp(begin_date) + pd.to_timedelta(seconds, unit='s')
+
+    web_logs = pd.DataFrame({
+        'user_id': user_ids[rng.choice(n_users, n_rows, p=activity)],
+        'page': rng.choice(['main', 'catalog', 'product', 'cart'], n_rows),
+        'date': generate_dates(n_rows),
+        'load_time': rng.lognormal(4., .5, n_rows).round(1),
+    })
+    sales = pd.DataFrame({
+        'sale_id': np.arange(n_sales).astype(str),
+        'user_id': user_ids[rng.choice(n_users, n_sales, p=activity)],
+        'date': generate_dates(n_sales),
+        'price': rng.lognormal(7., 1., n_sales).round(2),
+    })
+    return {'web-logs': web_logs, 'sales': sales}
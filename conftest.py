@@ -0,0 +1 @@
+# Модули лежат в корне репозитория, conftest.py в корне добавляет его в sys.path при запуске pytest.
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from DataService import DataService
+from benchmarks.synthetic import generate_tables
+
+
+def filter_by_mask(table, begin_date, end_date, user_ids=None, columns=None):
+    """Фильтрация масками, как в исходной реализации DataService.get_data_subset."""
+    if begin_date:
+        table = table[table['date'] >= begin_date]
+    if end_date:
+        table = table[table['date'] <= end_date]
+    if user_ids:
+        table = table[table['user_id'].isin(user_ids)]
+    if columns:
+        table = table[columns]
+    return table
+
+
+def get_cases(table):
+    user_ids = list(table['user_id'].drop_duplicates().sample(50, random_state=0)) + ['unknown']
+    return [
+        (None, None, None, None),
+        (pd.Timestamp('2022-01-05'), None, None, None),
+        (None, pd.Timestamp('2022-01-07 12:00'), None, None),
+        (pd.Timestamp('2022-01-05 06:30'), pd.Timestamp('2022-01-19'), None, ['user_id', 'load_time']),
+        (pd.Timestamp('2022-01-05'), pd.Timestamp('2022-01-09'), user_ids, None),
+        (None, None, user_ids[:1], None),
+        (pd.Timestamp('2022-01-05'), None, user_ids, ['user_id', 'date']),
+        (pd.Timestamp('2022-02-05'), None, None, None),
+    ]
+
+
+def assert_same_as_mask(data_service, table_name, table):
+    for begin_date, end_date, user_ids, columns in get_cases(table):
+        pd.testing.assert_frame_equal(
+            data_service.get_data_subset(table_name, begin_date, end_date, user_ids, columns),
+            filter_by_mask(table, begin_date, end_date, user_ids, columns),
+        )
+
+
+@pytest.fixture(scope='module')
+def web_logs():
+    return generate_tables(20_000, n_days=20, seed=1)['web-logs']
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_get_data_subset_matches_mask_filtering(web_logs, shuffle):
+    table = web_logs.sample(frac=1, random_state=0) if shuffle else web_logs
+    data_service = DataService({'web-logs': table})
+    assert_same_as_mask(data_service, 'web-logs', table)
+
+
+def test_get_data_subset_matches_mask_filtering_after_appends(web_logs):
+    # Пачки в хронологическом порядке, перемешанная пачка, пачка из прошлого и строки без даты и пользователя
+    parts = [
+        web_logs.iloc[5_000:12_000],
+        web_logs.iloc[12_000:13_000],
+        web_logs.iloc[13_000:16_000].sample(frac=1, random_state=0),
+        web_logs.iloc[:5_000],
+        web_logs.iloc[16_000:].assign(
+            date=lambda df: df['date'].mask(np.arange(len(df)) % 7 == 0),
+            user_id=lambda df: df['user_id'].mask(np.arange(len(df)) % 5 == 0),
+        ),
+    ]
+    data_service = DataService({'web-logs': parts[0].reset_index(drop=True)})
+    for n_parts in range(2, len(parts) + 1):
+        data_service.append_rows('web-logs', parts[n_parts - 1])
+        table = pd.concat(parts[:n_parts], ignore_index=True)
+        assert_same_as_mask(data_service, 'web-logs', table)
+
+
+def test_get_data_subset_matches_mask_filtering_after_micro_batches(web_logs):
+    # В маленьких пачках кодов пользователей больше, чем строк, для них индекс пользователей разреженный
+    table = web_logs.iloc[:15_000].reset_index(drop=True)
+    data_service = DataService({'web-logs': table})
+    for lo in range(15_000, 15_300, 30):
+        batch = web_logs.iloc[lo:lo + 30]
+        batch = batch.assign(user_id=batch['user_id'].where(batch.index % 3 > 0, 'new_' + batch['user_id']))
+        data_service.append_rows('web-logs', batch)
+        table = pd.concat([table, batch], ignore_index=True)
+    assert any(index.user_codes is not None for _, index in data_service.table_name_2_chunks['web-logs'])
+    assert_same_as_mask(data_service, 'web-logs', table)
+
+
+def test_table_name_2_table_returns_decoded_tables(web_logs):
+    data_service = DataService({'web-logs': web_logs.iloc[:15_000]})
+    data_service.append_rows('web-logs', web_logs.iloc[15_000:])
+    assert list(data_service.table_name_2_table) == ['web-logs']
+    pd.testing.assert_frame_equal(data_service.table_name_2_table['web-logs'], web_logs)
@@ -0,0 +1,127 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from ExperimentDesign import Design
+from ExperimentsService import ExperimentsService
+
+
+def make_design(**params):
+    return Design(
+        metric_name='metric', metric_outlier_lower_bound=0, metric_outlier_upper_bound=np.inf,
+        metric_outlier_process_type='drop', **params,
+    )
+
+
+def get_reference_ttest_pvalue(values_a, values_b):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return stats.ttest_ind(values_a, values_b).pvalue
+
+
+@pytest.mark.parametrize('effect_add_type', ['all_const', 'all_percent'])
+def test_batched_ttest_errors_match_scipy(effect_add_type):
+    rng = np.random.default_rng(0)
+    group_pairs = [tuple(rng.lognormal(3, 1, rng.integers(2, 50)) for _ in range(2)) for _ in range(20)]
+    # Пустая группа, группы из одного значения и группы без разброса
+    group_pairs += [
+        (np.array([]), rng.normal(size=10)),
+        (rng.normal(size=10), np.array([5.])),
+        (np.array([1.]), np.array([2.])),
+        (np.full(5, 3.), np.full(7, 3.)),
+    ]
+    design = make_design(effect=5.)
+    experiments_service = ExperimentsService()
+    experiments_service.ttest_batch_iter = 7
+    pvalues_aa, pvalues_ab, _, _ = experiments_service._estimate_errors_ttest(iter(group_pairs), design, effect_add_type)
+
+    expected_aa, expected_ab = [], []
+    for values_a, values_b in group_pairs:
+        expected_aa.append(get_reference_ttest_pvalue(values_a, values_b))
+        if effect_add_type == 'all_const':
+            values_b = values_b + values_b.mean() * (design.effect / 100)
+        else:
+            values_b = values_b * (1 + design.effect / 100)
+        expected_ab.append(get_reference_ttest_pvalue(values_a, values_b))
+    np.testing.assert_allclose(pvalues_aa, expected_aa, rtol=1e-10, atol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(pvalues_ab, expected_ab, rtol=1e-10, atol=1e-12, equal_nan=True)
+    assert np.isnan(pvalues_aa[-4]) and np.isnan(pvalues_aa[-2])
+
+
+def make_strata_groups(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    groups = []
+    for _ in range(2):
+        strata = rng.integers(0, 3, n)
+        groups.append(pd.DataFrame({'metric': rng.normal(10 + 5 * strata, 1 + strata), 'strata': strata}))
+    return groups
+
+
+def test_stratified_ttest_accepts_strata_weights_with_data_keys():
+    metrics_a_group, metrics_b_group = make_strata_groups()
+    design = make_design(statistical_test='stratified ttest', strata_weights={0: 1., 1: 2., 2: 1.})
+    pvalue = ExperimentsService().get_pvalue(metrics_a_group, metrics_b_group, design)
+    assert 0 <= pvalue <= 1
+
+
+@pytest.mark.parametrize('strata_weights', [{'0': 1., '1': 1., '2': 1.}, {0: 1., 1: 1.}, {0: 1., 1: 1., 2: 1., 3: 1.}])
+def test_stratified_ttest_rejects_strata_weights_not_matching_data(strata_weights):
+    metrics_a_group, metrics_b_group = make_strata_groups()
+    design = make_design(statistical_test='stratified ttest', strata_weights=strata_weights)
+    with pytest.raises(ValueError, match='не совпадают со стратами в данных'):
+        ExperimentsService().get_pvalue(metrics_a_group, metrics_b_group, design)
+
+
+@pytest.mark.parametrize('strata_weights', [None, {0: 0.2, 1: 0.5, 2: 0.3}])
+def test_stratified_ttest_matches_per_row_computation(strata_weights):
+    metrics_a_group, metrics_b_group = make_strata_groups()
+    metrics_b_group['metric'] += 0.5
+    design = make_design(statistical_test='stratified ttest', strata_weights=strata_weights)
+    pvalue = ExperimentsService().get_pvalue(metrics_a_group, metrics_b_group, design)
+
+    if strata_weights is None:
+        strata = pd.concat([metrics_a_group, metrics_b_group])['strata']
+        strata_weights = (strata.value_counts() / len(strata)).to_dict()
+    means, mean_variances = [], []
+    for group in (metrics_a_group, metrics_b_group):
+        mean, mean_variance = 0, 0
+        for stratum, weight in strata_weights.items():
+            values = group.loc[group['strata'] == stratum, 'metric'].values
+            mean += weight * values.mean()
+            mean_variance += weight ** 2 * values.var(ddof=1) / len(values)
+        means.append(mean)
+        mean_variances.append(mean_variance)
+    z = (means[1] - means[0]) / np.sqrt(sum(mean_variances))
+    assert pvalue == pytest.approx(2 * stats.norm.sf(abs(z)), rel=1e-9)
+
+
+def test_stratified_ttest_rejects_missing_and_small_strata():
+    metrics_a_group, metrics_b_group = make_strata_groups()
+    design = make_design(statistical_test='stratified ttest')
+    experiments_service = ExperimentsService()
+    with pytest.raises(ValueError, match='В группе B меньше двух значений в стратах \\[2\\]'):
+        experiments_service.get_pvalue(metrics_a_group, metrics_b_group[metrics_b_group['strata'] != 2], design)
+    one_value = metrics_a_group[metrics_a_group['strata'] == 1].iloc[:1]
+    metrics_a_group = pd.concat([metrics_a_group[metrics_a_group['strata'] != 1], one_value])
+    with pytest.raises(ValueError, match='В группе A меньше двух значений в стратах \\[1\\]'):
+        experiments_service.get_pvalue(metrics_a_group, metrics_b_group, design)
+
+
+def test_cuped_ttest_matches_per_row_computation():
+    rng = np.random.default_rng(1)
+    groups = []
+    for shift in (0, 0.3):
+        covariate = rng.lognormal(2, 0.5, 500)
+        groups.append(pd.DataFrame({'metric': 1e3 + 2 * covariate + rng.normal(shift, 1, 500), 'covariate': covariate}))
+    design = make_design(statistical_test='cuped ttest')
+    pvalue = ExperimentsService().get_pvalue(groups[0], groups[1], design)
+
+    data = pd.concat(groups)
+    theta = np.cov(data['metric'], data['covariate'])[0, 1] / data['covariate'].var()
+    cuped_values = [
+        group['metric'] - theta * (group['covariate'] - data['covariate'].mean()) for group in groups
+    ]
+    assert pvalue == pytest.approx(stats.ttest_ind(*cuped_values).pvalue, rel=1e-9)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import Instrumentation
+
+
+@Instrumentation.instrument('tests.operation')
+def operation(rows):
+    if rows:
+        Instrumentation.add_counters(rows_returned=rows)
+
+
+@pytest.fixture
+def profiling():
+    Instrumentation.reset()
+    with Instrumentation.profile():
+        yield
+    Instrumentation.reset()
+
+
+def test_summary_is_exact_for_few_calls(profiling):
+    values = [0, 0, 3, 5, 1, 8]
+    for rows in values:
+        operation(rows)
+    summary = Instrumentation.get_summary()['tests.operation']
+    counter = summary['counters']['rows_returned']
+    assert summary['calls'] == counter['count'] == len(values)
+    assert (counter['sum'], counter['max']) == (sum(values), max(values))
+    for q in Instrumentation.PERCENTILES:
+        assert counter[f'p{q}'] == pytest.approx(np.percentile(values, q))
+
+
+def test_summary_memory_does_not_grow_with_calls(profiling):
+    n_calls = 10 * Instrumentation.RESERVOIR_SIZE
+    for rows in range(n_calls):
+        operation(rows)
+    record = Instrumentation._records['tests.operation']
+    assert len(record['wall_time'].sample) == len(record['counters']['rows_returned'].sample) == Instrumentation.RESERVOIR_SIZE
+    counter = Instrumentation.get_summary()['tests.operation']['counters']['rows_returned']
+    assert (counter['count'], counter['sum'], counter['max']) == (n_calls, sum(range(n_calls)), n_calls - 1)
+    assert counter['p50'] == pytest.approx(n_calls / 2, rel=0.1)
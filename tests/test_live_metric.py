@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from DataService import DataService
+from ExperimentDesign import Design
+from ExperimentsService import ExperimentsService
+from MetricsService import MetricsService
+from benchmarks.synthetic import generate_tables
+
+
+BEGIN_DATE = pd.Timestamp('2022-01-08 12:00')
+SPLIT_DATE = pd.Timestamp('2022-01-12')
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return generate_tables(20_000, n_days=20, seed=2)
+
+
+@pytest.fixture(scope='module')
+def groups(tables):
+    user_ids = tables['web-logs']['user_id'].drop_duplicates().sample(600, random_state=0).tolist()
+    return {'A': user_ids[:300], 'B': user_ids[300:]}
+
+
+@pytest.mark.parametrize('metric_name', ['response time', 'revenue (web)', 'revenue (all)'])
+def test_live_metric_matches_full_recompute(tables, groups, metric_name):
+    initial = {name: table[table['date'] < SPLIT_DATE] for name, table in tables.items()}
+    metrics_service = MetricsService(DataService(initial))
+    live_metric = metrics_service.create_live_metric(metric_name, BEGIN_DATE, groups)
+
+    # Новые строки приходят перемешанными пачками вперемешку из двух таблиц
+    batches = []
+    for name, table in tables.items():
+        rest = table[table['date'] >= SPLIT_DATE].sample(frac=1, random_state=0)
+        batches.extend((name, rest.iloc[ix]) for ix in np.array_split(np.arange(len(rest)), 5))
+    for ix in np.random.default_rng(0).permutation(len(batches)):
+        metrics_service.append_data(*batches[ix])
+
+    full_metrics_service = MetricsService(DataService(tables))
+    user_ids = groups['A'] + groups['B']
+    metrics = full_metrics_service.calculate_metric(metric_name, BEGIN_DATE, None, user_ids)
+    values_a = metrics.loc[metrics['user_id'].isin(groups['A']), 'metric'].values
+    values_b = metrics.loc[metrics['user_id'].isin(groups['B']), 'metric'].values
+    stats_a, stats_b = live_metric.group_2_stats['A'], live_metric.group_2_stats['B']
+
+    assert (stats_a.count, stats_b.count) == (len(values_a), len(values_b))
+    assert np.isclose(stats_a.mean, values_a.mean()) and np.isclose(stats_b.mean, values_b.mean())
+    assert np.isclose(stats_a.variance, values_a.var(ddof=1)) and np.isclose(stats_b.variance, values_b.var(ddof=1))
+    design = Design(
+        metric_name=metric_name, metric_outlier_lower_bound=0, metric_outlier_upper_bound=np.inf,
+        metric_outlier_process_type='drop',
+    )
+    assert np.isclose(
+        ExperimentsService().get_pvalue_from_stats(stats_a, stats_b, design),
+        stats.ttest_ind(values_a, values_b).pvalue,
+    )
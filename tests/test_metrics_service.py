@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+from DataService import DataService, ParquetDataService
+from MetricsService import MetricDefinition, MetricsService
+from benchmarks.synthetic import generate_tables
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return generate_tables(20_000, n_days=20, seed=3)
+
+
+@pytest.mark.parametrize('metric_name', ['response time', 'revenue (web)', 'revenue (all)'])
+def test_calculate_metric_accepts_string_dates(tables, metric_name):
+    metrics_service = MetricsService(DataService(tables))
+    expected = metrics_service.calculate_metric(
+        metric_name, pd.Timestamp('2022-01-03 05:00'), pd.Timestamp('2022-01-06')
+    )
+    metrics = metrics_service.calculate_metric(metric_name, '2022-01-03 05:00', '2022-01-06')
+    pd.testing.assert_frame_equal(metrics.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_row_filter_uses_original_user_ids(tables):
+    excluded_user_ids = tables['sales']['user_id'].drop_duplicates().iloc[:3].tolist()
+    row_filter = f'user_id not in {excluded_user_ids} and price > 500'
+    definitions = [
+        MetricDefinition(name='prices', table_name='sales', value_column='price', row_filter=row_filter),
+        MetricDefinition(
+            name='revenue', table_name='sales', value_column='price', row_filter=row_filter, aggregation='sum',
+        ),
+    ]
+    initial = {name: table.iloc[:len(table) // 2] for name, table in tables.items()}
+    metrics_service = MetricsService(DataService(initial), metric_definitions=definitions)
+    metrics_service.calculate_metric('revenue', None, None)
+    for name, table in tables.items():
+        metrics_service.append_data(name, table.iloc[len(table) // 2:])
+
+    sales = tables['sales'].query(row_filter)
+    prices = metrics_service.calculate_metric('prices', None, None)
+    revenue = metrics_service.calculate_metric('revenue', None, None)
+    assert not prices['user_id'].isin(excluded_user_ids).any()
+    assert sorted(prices['metric']) == sorted(sales['price'])
+    pd.testing.assert_series_equal(
+        revenue.set_index('user_id')['metric'].sort_index(),
+        sales.groupby('user_id')['price'].sum().sort_index(),
+        check_names=False,
+    )
+
+
+def calculate_revenue(tables, begin_date, end_date, population_begin_date):
+    """Выручка пользователей полным пересчётом по сырым таблицам, как в исходной реализации MetricsService."""
+    web_logs, sales = tables['web-logs'], tables['sales']
+    population = web_logs.loc[
+        (web_logs['date'] >= population_begin_date) & (web_logs['date'] <= end_date), 'user_id'
+    ].unique()
+    sales = sales[(sales['date'] >= begin_date) & (sales['date'] <= end_date)]
+    revenue = sales.groupby('user_id')['price'].sum()
+    return revenue.reindex(population, fill_value=0).sort_index()
+
+
+@pytest.mark.parametrize('storage', ['memory', 'parquet'])
+def test_aggregates_built_by_chunks_match_full_recompute(tables, storage, tmp_path):
+    if storage == 'memory':
+        data_service = DataService(tables)
+    else:
+        pytest.importorskip('pyarrow')
+        data_service = ParquetDataService(str(tmp_path), tables)
+    data_service.read_chunk_size = 1_000
+    metrics_service = MetricsService(data_service)
+    begin_date, end_date = pd.Timestamp('2022-01-03 05:00'), pd.Timestamp('2022-01-16 20:00')
+    for metric_name, population_begin_date in [('revenue (web)', begin_date), ('revenue (all)', pd.Timestamp.min)]:
+        metrics = metrics_service.calculate_metric(metric_name, begin_date, end_date)
+        pd.testing.assert_series_equal(
+            metrics.set_index('user_id')['metric'].sort_index().astype(float),
+            calculate_revenue(tables, begin_date, end_date, population_begin_date).astype(float),
+            check_names=False, check_index_type=False,
+        )